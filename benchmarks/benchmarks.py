@@ -0,0 +1,167 @@
+# Stacasso benchmarks, in airspeed velocity (asv) style, see asv.conf.json
+#
+#   asv run                    (benchmark the commits on the current branch)
+#   asv run --python=same      (just the installed version, in this environment)
+#
+# time_* benchmarks are timed, peakmem_* measure the peak memory of the process,
+# track_* record a number (such as the number of matplotlib artists),
+# and timeraw_* time a piece of code in a fresh python process (cold start, imports included)
+
+import io
+
+import cirq
+import numpy as np
+
+import hlf
+import stacasso
+
+
+def make_circuit(n_qubits, depth, seed=0):
+    """ random circuit (the same circuit, for a given seed) """
+    return cirq.testing.random_circuit(qubits=n_qubits,
+                                       n_moments=depth,
+                                       op_density=.8,
+                                       random_state=seed)
+
+
+def count_artists(fig):
+    """ number of artists drawn on the figure's axes """
+    return sum(len(ax.get_children()) for ax in fig.axes)
+
+
+class UnscrambleWavefunction:
+    params = ([4, 10, 14, 18], [1, 32])
+    param_names = ['n_qubits', 'moments']
+
+    def setup(self, n_qubits, moments):
+        rng = np.random.default_rng(0)
+        shape = (moments, 2**n_qubits) if moments > 1 else (2**n_qubits,)
+        self.wavefunction = rng.random(shape) + 1j*rng.random(shape)
+        # warm the permutation cache, like repeated calls in a simulation
+        stacasso.unscramble_wavefunction(self.wavefunction)
+
+    def time_unscramble(self, n_qubits, moments):
+        stacasso.unscramble_wavefunction(self.wavefunction)
+
+
+class MakeWavefunctionList:
+    params = ([4, 8, 12], [10, 40])
+    param_names = ['n_qubits', 'depth']
+
+    def setup(self, n_qubits, depth):
+        self.circuit = make_circuit(n_qubits, depth)
+
+    def time_list(self, n_qubits, depth):
+        stacasso.make_wavefunction_list(self.circuit)
+
+    def time_array(self, n_qubits, depth):
+        stacasso.make_wavefunction_list(self.circuit, as_array=True)
+
+    def peakmem_list(self, n_qubits, depth):
+        stacasso.make_wavefunction_list(self.circuit)
+
+    def peakmem_array(self, n_qubits, depth):
+        stacasso.make_wavefunction_list(self.circuit, as_array=True)
+
+
+class Highlight:
+    params = ([4, 10], [10, 100, 1000])
+    param_names = ['n_qubits', 'depth']
+
+    def setup(self, n_qubits, depth):
+        self.circuit = make_circuit(n_qubits, depth)
+
+    def time_highlight(self, n_qubits, depth):
+        stacasso.highlight(self.circuit, title='"benchmark"')
+
+    def peakmem_highlight(self, n_qubits, depth):
+        stacasso.highlight(self.circuit, title='"benchmark"')
+
+    def time_highlight_first_window(self, n_qubits, depth):
+        next(stacasso.highlight_windows(self.circuit, 100, title='"benchmark"'))
+
+    def time_highlight_windows(self, n_qubits, depth):
+        for fragment in stacasso.highlight_windows(self.circuit, 100, title='"benchmark"'):
+            pass
+
+    def peakmem_highlight_windows(self, n_qubits, depth):
+        for fragment in stacasso.highlight_windows(self.circuit, 100, title='"benchmark"'):
+            pass
+
+
+class Illustrate:
+    params = ([2, 4, 6], [5, 20])
+    param_names = ['n_qubits', 'depth']
+
+    def setup(self, n_qubits, depth):
+        self.circuit = make_circuit(n_qubits, depth)
+
+    def time_illustrate(self, n_qubits, depth):
+        stacasso.illustrate_figure(self.circuit)
+
+    def time_illustrate_savefig_svg(self, n_qubits, depth):
+        fig = stacasso.illustrate_figure(self.circuit)
+        fig.savefig(io.StringIO(), format='svg')
+
+    def time_illustrate_savefig_png(self, n_qubits, depth):
+        fig = stacasso.illustrate_figure(self.circuit)
+        fig.savefig(io.BytesIO(), format='png')
+
+    def time_illustrate_native_svg(self, n_qubits, depth):
+        stacasso.illustrate_svg(self.circuit)
+
+    def track_native_svg_size(self, n_qubits, depth):
+        return len(stacasso.illustrate_svg(self.circuit))
+
+    track_native_svg_size.unit = 'bytes'
+
+    def track_savefig_svg_size(self, n_qubits, depth):
+        return len(stacasso.illustrate_svg(self.circuit, native=False))
+
+    track_savefig_svg_size.unit = 'bytes'
+
+    def peakmem_illustrate_savefig_svg(self, n_qubits, depth):
+        fig = stacasso.illustrate_figure(self.circuit)
+        fig.savefig(io.StringIO(), format='svg')
+
+    def track_artist_count(self, n_qubits, depth):
+        return count_artists(stacasso.illustrate_figure(self.circuit))
+
+    track_artist_count.unit = 'artists'
+
+
+class BruteforceSolve:
+    params = [4, 6, 8, 10]
+    param_names = ['n']
+
+    def setup(self, n):
+        self.problem = hlf.random_problem(n, seed=0)
+
+    def time_bruteforce_solve(self, n):
+        self.problem.bruteforce_solve()
+
+    def peakmem_bruteforce_solve(self, n):
+        self.problem.bruteforce_solve()
+
+
+class ImportTime:
+    """ cold start, each timeraw_* benchmark runs in a fresh python process """
+
+    def timeraw_import_stacasso(self):
+        return 'import stacasso'
+
+    def timeraw_import_and_highlight(self):
+        return """
+        import cirq
+        import stacasso
+        q = cirq.LineQubit.range(2)
+        stacasso.highlight(cirq.Circuit([cirq.H(q[0]), cirq.CNOT(q[0], q[1])]))
+        """
+
+    def timeraw_import_and_illustrate(self):
+        return """
+        import cirq
+        import stacasso
+        q = cirq.LineQubit.range(2)
+        stacasso.illustrate_figure(cirq.Circuit([cirq.H(q[0]), cirq.CNOT(q[0], q[1])]))
+        """
@@ -31,5 +31,10 @@ setuptools.setup(
     ],
     package_dir={"": "src"},
     packages=setuptools.find_packages(where="src"),
-    python_requires=">=3.6",
+    py_modules=["stacasso", "stacasso_cli", "stacasso_server", "hlf", "tele", "_version"],
+    entry_points={
+        "console_scripts": ["stacasso=stacasso_cli:main",
+                            "stacasso-server=stacasso_server:main"],
+    },
+    python_requires=">=3.9",
 )
\ No newline at end of file
@@ -3,58 +3,56 @@
 # Examples from Google Cirq tutorial
 # https://quantumai.google/cirq/tutorials/hidden_linear_function
 
+import collections
+import concurrent.futures
+import os
+import time
+
 import numpy as np
 import cirq
 
 
-def make_interesting_circuit( n_qubits = 3 ):
+# depending on the size of the problem (number of qubits),
+# l (min_L_size) must be set appropriately, to have a small number of solutions
+# (other sizes use the value from the original google code, for ten qubits)
+interesting_min_L_sizes = {3: 4, 4: 5, 5: 12, 10: 4}
+
+
+def make_interesting_circuit( n_qubits = 3, min_L_size = None, seed = None, workers = None,
+                              max_attempts = 10000, timeout = None ):
     """ Create smaller version of the HLF2D problem (3, 4 and 5 qubits)
           q is number of qubits,
-          l is min_L_size
+          l is min_L_size (by default, from interesting_min_L_sizes)
     
         Every HLF2D problem has zero as an answer (???),
         and can have additional answers
         interesting versions of the problem have only a few answers
+
+        the problem is found with search_interesting_problem (in parallel,
+        reproducible with seed), raises RuntimeError if none is found within
+        max_attempts (or timeout seconds)
     """
 
     # original code uses 'q'
     q = n_qubits
-
-    # depending on the size of the problem (number of qubits),
-    # l must be set appropriately, to have a small number of solutions
-    if q == 3:
-        # three qubits
-        l = 4
-    elif q == 4:
-        # four qubits
-        l = 5
-    elif q == 5:
-        l = 12
-    elif q == 10:
-        # ten qubits (number from original google code)
-        l = 4
-    else:
-        assert False,'need to find a good l for this q'
+    l = min_L_size if min_L_size is not None else interesting_min_L_sizes.get(q, 4)
 
     print('Creating an HLF 2D problem instance with')
     print('  ', q, 'qubits', '\n  ', l, 'min size of L subspace\n')
 
-    problem = None
-
-    while problem is None:
-        # careful! this never exits ... 
-        # just make sure q and l are set correctly
-        print('finding interesting problem ... ', end='')
-        problem = find_interesting_problem(q, l)
-        if problem is None:
-            print('(not found)')
-        else:
-            print('done!')
+    print('finding interesting problem ... ', end='')
+    problem = search_interesting_problem(q, l, seed=seed, workers=workers,
+                                         max_attempts=max_attempts, timeout=timeout)
+    if problem is None:
+        print('(not found)')
+        raise RuntimeError('no interesting problem found for ' + str(q) + ' qubits, '
+                           'try a smaller min_L_size, or more attempts')
+    print('done!')
 
     # the original google code uses 10 qbits
 
-    print("Size of subspace L:", len(problem.L))
-    print("Number of solutions: %d" % len(problem.all_zs))
+    print("Size of subspace L:", problem.L_space.size)
+    print("Number of solutions: %d" % problem.z_space.size)
 
     hlf_circuit = generate_circuit_for_problem(problem)
 
@@ -79,6 +77,8 @@ class HiddenLinearFunctionProblem:
 
         self.A = A
         self.b = b
+        self._circuit = None
+        self._circuit_key = None
 
     def q(self, x):
         """Action of quadratic form on binary vector (modulo 4).
@@ -88,56 +88,218 @@ class HiddenLinearFunctionProblem:
         assert x.shape == (self.n, )
         return (2 * (x @ self.A @ x) + (self.b @ x)) % 4
 
+    def q_all(self, X):
+        """Action of quadratic form on every row of the binary matrix `X` (modulo 4).
+
+        Same as calling `q` on each row, as a single matrix expression.
+        """
+        assert X.ndim == 2 and X.shape[1] == self.n
+        return (2 * np.sum((X @ self.A) * X, axis=1) + (X @ self.b)) % 4
+
     def bruteforce_solve(self):
-        """Calculates, by definition, all vectors `z` which are solutions to the problem."""
+        """Calculates, by definition, all vectors `z` which are solutions to the problem.
 
-        # All binary vectors of length `n`.
-        all_vectors = [np.array([(m >> i) % 2 for i in range(self.n)])
-                       for m in range(2**self.n)]
+        `q` is evaluated once for all binary vectors (the q-table), and the
+        definitions of `L` and of the solutions are checked as array operations on it.
+        """
 
-        def vector_in_L(x):
-            for y in all_vectors:
-                if self.q((x + y) % 2) != (self.q(x) + self.q(y)) % 4:
-                    return False
-            return True
+        # All binary vectors of length `n`, as rows (row `m` holds the bits of `m`).
+        indices = np.arange(2**self.n)
+        all_vectors = (indices[:, np.newaxis] >> np.arange(self.n)) % 2
+        q_table = self.q_all(all_vectors)
 
         # L is subspace to which we restrict domain of quadratic form.
         # Corresponds to `L_q` in the problem definition.
-        self.L = [x for x in all_vectors if vector_in_L(x)]
-
-        # All vectors `z` which are solutions to the problem.
-        self.all_zs = [z for z in all_vectors if self.is_z(z)]
+        # `x` is in L if q(x + y) == q(x) + q(y) for every `y`,
+        # where (x + y) % 2 is the vector with index x ^ y.
+        # The unit vectors `y` are checked first, which cheaply rules out
+        # most vectors, then the remaining candidates are checked against every `y`.
+        units = 2**np.arange(self.n)
+        x = indices[:, np.newaxis]
+        candidates = indices[np.all(q_table[x ^ units] == (q_table[x] + q_table[units]) % 4, axis=1)]
+
+        in_L = np.zeros(2**self.n, dtype=bool)
+        for rows in _row_blocks(len(candidates), 2**self.n):
+            x = candidates[rows, np.newaxis]
+            in_L[candidates[rows]] = np.all(q_table[x ^ indices] == (q_table[x] + q_table) % 4, axis=1)
+        self.L = list(all_vectors[in_L])
+
+        # All vectors `z` which are solutions to the problem,
+        # q(x) == 2 * (z @ x % 2) for every `x` in L.
+        L = all_vectors[in_L]
+        solutions = np.zeros(2**self.n, dtype=bool)
+        for rows in _row_blocks(2**self.n, len(L)):
+            solutions[rows] = np.all(2 * ((all_vectors[rows] @ L.T) % 2) == q_table[in_L], axis=1)
+        self.all_zs = list(all_vectors[solutions])
 
     def is_z(self, z):
         """Checks by definition, whether given vector `z` is solution to this problem."""
         assert z.shape == (self.n, )
         assert self.L is not None
-        for x in self.L:
-            if self.q(x) != 2 * ((z @ x) % 2):
-                return False
-        return True
+        L = np.array(self.L).reshape(-1, self.n)
+        return bool(np.all(self.q_all(L) == 2 * ((L @ z) % 2)))
+
+    def gf2_solve(self):
+        """Calculates `L` and all solutions `z` with linear algebra over GF(2).
+
+        Runs in polynomial time (unlike `bruteforce_solve`), so it works for
+        large `n`. Expanding q(x + y) shows `x` is in `L` exactly when
+        (A + A^T + diag(b)) @ x == 0 (mod 2), so `L` is the null space of that matrix.
+        On `L`, q(x) == 2 * l(x) for a linear function `l`, and the solutions are
+        the `z` with z @ x == l(x) (mod 2) for every `x` in a basis of `L`.
+
+        Sets `L_space` (subspace `L`) and `z_space` (all solutions), as `AffineSubspace`s,
+        which can be enumerated lazily, without storing every vector.
+        """
+        M = (self.A + self.A.T + np.diag(self.b)) % 2
+        self.L_space = AffineSubspace(np.zeros(self.n, dtype=np.uint8), _gf2_null_space(M))
+
+        L_basis = self.L_space.basis
+        l_values = self.q_all(L_basis.astype(int)) // 2
+        self.z_space = AffineSubspace(_gf2_solve(L_basis, l_values), _gf2_null_space(L_basis))
+
+    def is_solution(self, z):
+        """Checks whether given vector `z` is solution to this problem.
+
+        Same result as `is_z`, but only checks the basis of `L` (from `gf2_solve`),
+        instead of iterating over all of `L`.
+        """
+        assert z.shape == (self.n, )
+        L_basis = self.L_space.basis.astype(int)
+        return bool(np.all(self.q_all(L_basis) == 2 * ((L_basis @ z) % 2)))
+
+    def circuit(self):
+        """Circuit which solves this problem (from `generate_circuit_for_problem`).
+
+        The circuit is generated once and cached, until `A` or `b` change.
+        """
+        key = (self.A.tobytes(), self.b.tobytes())
+        if self._circuit is None or self._circuit_key != key:
+            self._circuit = generate_circuit_for_problem(self)
+            self._circuit_key = key
+        return self._circuit
 
 # end class, functions here
 
 
-def random_problem(n, seed=None):
+class AffineSubspace:
+    """Affine subspace of binary vectors (over GF(2)).
+
+    Contains `offset` plus every sum (modulo 2) of the rows of `basis`,
+    which must be linearly independent. Iterating yields the vectors one at a time.
+    """
+
+    def __init__(self, offset, basis):
+        self.offset = np.asarray(offset, dtype=np.uint8) % 2
+        self.basis = np.asarray(basis, dtype=np.uint8).reshape(-1, len(self.offset)) % 2
+
+    @property
+    def dimension(self):
+        return len(self.basis)
+
+    @property
+    def size(self):
+        """Number of vectors in the subspace (2**dimension, can be very large)."""
+        return 2**self.dimension
+
+    def __iter__(self):
+        # Gray code order, each vector differs from the previous one by a single basis vector.
+        x = self.offset.copy()
+        yield x.copy()
+        for i in range(1, self.size):
+            x ^= self.basis[(i & -i).bit_length() - 1]
+            yield x.copy()
+
+    def __contains__(self, x):
+        x = np.asarray(x) % 2
+        if self.dimension == 0:
+            return bool(np.all(x == self.offset))
+        return _gf2_solve(self.basis.T, x ^ self.offset) is not None
+
+
+def _gf2_row_reduce(M):
+    """Reduced row echelon form of binary matrix `M` (over GF(2)).
+
+    Returns the nonzero rows, and the pivot column of each row.
+    """
+    M = np.array(M, dtype=np.uint8) % 2
+    pivots = []
+    for col in range(M.shape[1]):
+        row = len(pivots)
+        if row == M.shape[0]:
+            break
+        nonzero = np.flatnonzero(M[row:, col])
+        if len(nonzero) == 0:
+            continue
+        M[[row, row + nonzero[0]]] = M[[row + nonzero[0], row]]
+
+        # clear the column, in every other row
+        others = np.flatnonzero(M[:, col])
+        M[others[others != row]] ^= M[row]
+        pivots.append(col)
+
+    return M[:len(pivots)], pivots
+
+
+def _gf2_null_space(M):
+    """Basis (as rows) of the vectors `x` with M @ x == 0 (mod 2)."""
+    R, pivots = _gf2_row_reduce(M)
+    n = M.shape[1]
+    free = [col for col in range(n) if col not in set(pivots)]
+
+    basis = np.zeros((len(free), n), dtype=np.uint8)
+    for i, col in enumerate(free):
+        basis[i, col] = 1
+        basis[i, pivots] = R[:, col]
+    return basis
+
+
+def _gf2_solve(M, t):
+    """One vector `x` with M @ x == t (mod 2), or None if there is no solution."""
+    M = np.asarray(M, dtype=np.uint8)
+    n = M.shape[1]
+    R, pivots = _gf2_row_reduce(np.column_stack([M, np.asarray(t, dtype=np.uint8)]))
+    if n in pivots:
+        # a row reads 0 == 1
+        return None
+
+    x = np.zeros(n, dtype=np.uint8)
+    x[pivots] = R[:, n]
+    return x
+
+
+def _row_blocks(n_rows, row_length, max_elements=2**22):
+    """Splits `n_rows` into slices, so each block of rows has at most `max_elements`
+    (`row_length` elements per row), to bound the memory of the array checks."""
+    block_size = max(1, max_elements // max(1, row_length))
+    for start in range(0, n_rows, block_size):
+        yield slice(start, min(start + block_size, n_rows))
+
+
+def random_problem(n, seed=None, rng=None):
     """Generates instance of the problem with given `n`.
 
     Args:
         n: dimension of the problem.
+        seed: seeds the global `np.random` generator (if `rng` is not given).
+        rng: `np.random.Generator` to draw from, instead of the global generator.
     """
-    if seed is not None:
-        np.random.seed(seed)
-    A = np.random.randint(0, 2, size=(n, n))
+    if rng is None:
+        if seed is not None:
+            np.random.seed(seed)
+        randint = np.random.randint
+    else:
+        randint = rng.integers
+    A = randint(0, 2, size=(n, n))
     for i in range(n):
         for j in range(i+1):
             A[i][j] = 0
-    b = np.random.randint(0, 2, size=n)
+    b = randint(0, 2, size=n)
     problem = HiddenLinearFunctionProblem(A, b)
     return problem
 
 
-def find_interesting_problem(n, min_L_size):
+def find_interesting_problem(n, min_L_size, rng=None):
     """Generates "interesting" instance of the problem.
 
     Returns instance of problem with given `n`, such that size of 
@@ -146,68 +308,244 @@ def find_interesting_problem(n, min_L_size):
     Args:
         n: dimension of the problem.
         min_L_size: minimal cardinality of subspace L.
+        rng: `np.random.Generator` to draw from, instead of the global generator.
     """
     for _ in range(1000):
-        problem = random_problem(n)
+        problem = random_problem(n, rng=rng)
         problem.bruteforce_solve()
         if len(problem.L) >= min_L_size and not np.max(problem.A) == 0:
             return problem
     return None
 
 
+def search_interesting_problem(n, min_L_size, seed=None, workers=None, max_attempts=10000,
+                               timeout=None, batch_size=50):
+    """Searches for an "interesting" instance of the problem, in parallel.
+
+    Same criterion as `find_interesting_problem`, but candidates are checked with
+    `gf2_solve` (so `n` can be large), across a pool of `workers` processes.
+    Attempt `i` draws from its own `np.random.Generator` stream (spawned from `seed`),
+    and the first successful attempt (lowest `i`) is returned, so the result only
+    depends on `seed`, not on the number of workers.
+    Stops as soon as that attempt is known, and gives up (returns None)
+    after `max_attempts`, or after `timeout` seconds. Once an attempt has
+    succeeded, the timeout no longer applies: only the earlier batches are
+    left, and they are waited for, so the result stays reproducible.
+
+    Returns the problem, with `L_space` and `z_space` set (see `gf2_solve`).
+    """
+    entropy = np.random.SeedSequence(seed).entropy
+    workers = workers or os.cpu_count()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    starts = iter(range(0, max_attempts, batch_size))
+
+    best = None
+    pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+    try:
+        # batches are submitted in order, a few per worker at a time
+        pending = {}
+
+        def submit_next():
+            start = next(starts, None)
+            if start is not None and best is None:
+                stop = min(start + batch_size, max_attempts)
+                pending[pool.submit(_search_batch, n, min_L_size, entropy, start, stop)] = start
+
+        for _ in range(2*workers):
+            submit_next()
+
+        # once an attempt succeeds, only the earlier batches still need to finish
+        while pending:
+            remaining = None
+            if deadline is not None and best is None:
+                remaining = max(0, deadline - time.monotonic())
+            done, _ = concurrent.futures.wait(pending, timeout=remaining,
+                                              return_when=concurrent.futures.FIRST_COMPLETED)
+            if not done:
+                # out of time, with no attempt found yet
+                return None
+
+            for future in done:
+                del pending[future]
+                if future.result() is not None:
+                    best = future.result() if best is None else min(best, future.result())
+                submit_next()
+
+            if best is not None:
+                for future, start in list(pending.items()):
+                    if start > best:
+                        future.cancel()
+                        del pending[future]
+    finally:
+        # on a timeout, the batches still running are not waited for
+        pool.shutdown(wait=False, cancel_futures=True)
+
+    if best is None:
+        return None
+
+    problem = _attempt_problem(n, entropy, best)
+    problem.gf2_solve()
+    return problem
+
+
+def _attempt_problem(n, entropy, attempt):
+    """The random problem for the given attempt of search_interesting_problem."""
+    rng = np.random.default_rng(np.random.SeedSequence(entropy, spawn_key=(attempt,)))
+    return random_problem(n, rng=rng)
+
+
+def _search_batch(n, min_L_size, entropy, start, stop):
+    """Returns the first interesting attempt in range(start, stop), or None (runs in a worker)."""
+    for attempt in range(start, stop):
+        problem = _attempt_problem(n, entropy, attempt)
+        problem.gf2_solve()
+        if problem.L_space.size >= min_L_size and not np.max(problem.A) == 0:
+            return attempt
+    return None
+
+
 # quantum solution starts here
-def edge_coloring(A):
+def edge_coloring(A, verbose=False):
     """Solves edge coloring problem.
 
     Args:
         A: adjacency matrix of a graph.
+        verbose: print the number of edges, max degree and layers.
 
     Returns list of lists of edges, such as edges in each list 
     do not have common vertex. 
-    Tries to minimize length of this list.
+    Uses the Misra-Gries algorithm, so there are at most (max degree + 1)
+    lists, one more than the minimum possible. Each edge is colored by
+    walking its fan and one alternating path, in roughly O(E * max degree).
     """
-    A = np.copy(A)
+    A = np.asarray(A)
     n = A.shape[0]
-    ans = []
-    while np.max(A) != 0:
-        edges_group = []
-        used = np.zeros(n, dtype=np.bool)
-        for i in range(n):
-            for j in range(n):
-                if A[i][j] == 1 and not used[i] and not used[j]:
-                    edges_group.append((i, j))
-                    A[i][j] = 0
-                    used[i] = used[j] = True
-        ans.append(edges_group)
+
+    # undirected edges (i, j), with i < j
+    edges = [(int(i), int(j)) for i, j in zip(*np.nonzero(np.triu((A != 0) | (A.T != 0), 1)))]
+
+    # color of each edge, seen from both ends: neighbor_color[u][v] is the color of (u, v),
+    # and color_neighbor[u][c] is the neighbor of u along the edge with color c
+    neighbor_color = [{} for _ in range(n)]
+    color_neighbor = [{} for _ in range(n)]
+
+    def set_color(u, v, c):
+        neighbor_color[u][v] = neighbor_color[v][u] = c
+        color_neighbor[u][c] = v
+        color_neighbor[v][c] = u
+
+    def clear_color(u, v):
+        c = neighbor_color[u].pop(v)
+        del neighbor_color[v][u]
+        del color_neighbor[u][c]
+        del color_neighbor[v][c]
+
+    def free_color(u):
+        c = 0
+        while c in color_neighbor[u]:
+            c += 1
+        return c
+
+    for u, v in edges:
+        c = free_color(u)
+
+        # fan of u, starting at v: the color of each edge (u, fan[i+1]) is free at fan[i],
+        # it is extended until it is maximal, or c is free at its end (then d = c,
+        # and there is nothing to invert)
+        fan = [v]
+        in_fan = {v}
+        extended = True
+        while extended and c in color_neighbor[fan[-1]]:
+            extended = False
+            for color, w in color_neighbor[u].items():
+                if w not in in_fan and color not in color_neighbor[fan[-1]]:
+                    fan.append(w)
+                    in_fan.add(w)
+                    extended = True
+                    break
+
+        d = c if c not in color_neighbor[fan[-1]] else free_color(fan[-1])
+
+        # invert the path from u, which alternates colors d and c
+        path = []
+        x, color = u, d
+        while color in color_neighbor[x]:
+            y = color_neighbor[x][color]
+            path.append((x, y, color))
+            x, color = y, (c if color == d else d)
+        for x, y, color in path:
+            clear_color(x, y)
+        for x, y, color in path:
+            set_color(x, y, c if color == d else d)
+
+        # now d is free at u, find a fan vertex w where d is free, that is still
+        # the end of a fan (after the inversion)
+        end = 0
+        for i, w in enumerate(fan):
+            if i > 0 and neighbor_color[u][w] in color_neighbor[fan[i-1]]:
+                break
+            if d not in color_neighbor[w]:
+                end = i
+                break
+
+        # rotate the fan up to w, and color (u, w) with d
+        shifted = [neighbor_color[u][w] for w in fan[1:end+1]]
+        for w in fan[1:end+1]:
+            clear_color(u, w)
+        for w, color in zip(fan, shifted):
+            set_color(u, w, color)
+        set_color(u, fan[end], d)
+
+    # one list of edges per color
+    ans = [[] for _ in range(max((max(c.values(), default=-1) for c in neighbor_color), default=-1) + 1)]
+    for u, v in edges:
+        ans[neighbor_color[u][v]].append((u, v))
+    ans = [edges_group for edges_group in ans if edges_group]
+
+    if verbose:
+        max_degree = max((len(c) for c in neighbor_color), default=0)
+        print('edge coloring:', len(edges), 'edges, max degree', max_degree, '->', len(ans), 'layers')
+
     return ans
 
 
-def generate_circuit_for_problem(problem):
-    """Generates `cirq.Circuit` which solves instance of Hidden Linear Function problem."""
+def generate_circuit_for_problem(problem, pattern_only=False):
+    """Generates `cirq.Circuit` which solves instance of Hidden Linear Function problem.
 
-    qubits = cirq.LineQubit.range(problem.n)
-    circuit = cirq.Circuit()
+    The circuit is built in one pass, from one `cirq.Moment` per layer of
+    `edge_coloring` (so the CZ gates are not re-scheduled one by one).
+
+    Args:
+        problem: the `HiddenLinearFunctionProblem`.
+        pattern_only: only the CZ/S pattern encoding the problem (the CZ
+            layers, then the S gates), without Hadamards and measurements.
+
+    Returns the circuit.
+    """
 
-    # Hadamard gates at the beginning (creating equal superposition of all states).
-    circuit += cirq.Moment([cirq.H(q) for q in qubits])
+    qubits = cirq.LineQubit.range(problem.n)
 
-    # Controlled-Z gates encoding the matrix A.
-    for layer in edge_coloring(problem.A):
-        for i, j in layer:
-            circuit += cirq.CZ(qubits[i], qubits[j])
+    # Controlled-Z gates encoding the matrix A, one moment per layer.
+    pattern = [cirq.Moment([cirq.CZ(qubits[i], qubits[j]) for i, j in layer])
+               for layer in edge_coloring(problem.A)]
 
     # S gates encoding the vector b.
-    circuit += cirq.Moment([cirq.S.on(qubits[i])
-                            for i in range(problem.n) if problem.b[i] == 1])
+    if any(problem.b):
+        pattern.append(cirq.Moment([cirq.S.on(qubits[i])
+                                    for i in range(problem.n) if problem.b[i] == 1]))
 
-    # Hadamard gates at the end.
-    circuit += cirq.Moment([cirq.H(q) for q in qubits])
+    if pattern_only:
+        return cirq.Circuit(pattern)
+
+    # Hadamard gates at the beginning (creating equal superposition of all states),
+    # and at the end.
+    hadamards = cirq.Moment([cirq.H(q) for q in qubits])
 
     # Measurements.
-    circuit += cirq.Moment([cirq.measure(qubits[i], key=str(i))
-                            for i in range(problem.n)])
+    measurements = cirq.Moment([cirq.measure(qubits[i], key=str(i))
+                                for i in range(problem.n)])
 
-    return circuit
+    return cirq.Circuit([hadamards] + pattern + [hadamards, measurements])
 
 
 def solve_problem(problem, print_circuit=False):
@@ -219,7 +557,7 @@ def solve_problem(problem, print_circuit=False):
     Returns measurement result as binary vector, which is
     guaranteed to be a solution to given problem.
     """
-    circuit = generate_circuit_for_problem(problem)
+    circuit = problem.circuit()
 
     if print_circuit:
         print(circuit)
@@ -230,6 +568,29 @@ def solve_problem(problem, print_circuit=False):
     return z
 
 
+def sample_problem(problem, shots=1000, seed=None):
+    """Solves instance of Hidden Linear Function problem, many times.
+
+    Runs the (cached) circuit for given problem once, with the Clifford
+    simulator, sampling `shots` measurements.
+
+    Args:
+        problem: the `HiddenLinearFunctionProblem`.
+        shots: number of solutions to sample.
+        seed: seed for the simulator (for reproducible samples).
+
+    Returns:
+        zs: `(shots, n)` uint8 array, one solution per row.
+        counts: `collections.Counter`, from each distinct solution (as a tuple)
+            to the number of times it was sampled.
+    """
+    sim = cirq.CliffordSimulator(seed=seed)
+    result = sim.run(problem.circuit(), repetitions=shots)
+    zs = np.hstack([result.measurements[str(i)] for i in range(problem.n)]).astype(np.uint8)
+    counts = collections.Counter(map(tuple, zs.tolist()))
+    return zs, counts
+
+
 def test1():
     problem = find_interesting_problem(10, 4)
     print("Size of subspace L: %d" % len(problem.L))
@@ -1,14 +1,27 @@
-from IPython.display import display, Markdown, HTML
 import numpy as np
-import matplotlib.pyplot as plt
-import cirq
-import cmath
+import collections
+import contextlib
+import functools
+import hashlib
+import html
+import io
+import itertools
+import json
+import os
 from html.parser import HTMLParser
 import re
+import subprocess
+import threading
+import time
+import tracemalloc
 
 # make the version available with so.__version__
 from _version import __version__
 
+# cirq, matplotlib (and pyplot) and IPython are slow to import, so they are imported
+# in the functions that use them (only on first use, then python has them cached),
+# so import stacasso is fast, and highlighting a circuit never loads IPython
+
 # TODO: qubit names in 'highlight' should be padded (right aligned), when unequal lengths
 #         also requires removing some of the circuit line ... but needs to be done!
 
@@ -18,116 +31,145 @@ from _version import __version__
 # https://www.w3schools.com/colors/colors_names.asp
 # Pyplot uses the some color names ...
 #  this list is losely based on the tab10 default python color scheme
-#  ... colors up to six qubits so far ...
-qubit_cmap = ['Blue', 'DarkOrange', 'ForestGreen', 'DarkRed', 'Purple', 'Brown']
+#  ... colors up to ten qubits, then the colors repeat ...
+qubit_cmap = ['Blue', 'DarkOrange', 'ForestGreen', 'DarkRed', 'Purple', 'Brown',
+              'HotPink', 'Gray', 'Olive', 'DarkCyan']
+
+
+@functools.lru_cache(maxsize=None)
+def _unscramble_permutation(n_qubits):
+    """ returns the (read-only) index permutation used by unscramble_wavefunction,
+        cached per qubit count
+
+        the scrambled order is the bit-reversed state order, so entry i
+        holds the index of state i with its n_qubits bits reversed
+    """
+    states = np.arange(2**n_qubits)
+    permutation = np.zeros_like(states)
+    for bit in range(n_qubits):
+        permutation |= ((states >> bit) & 1) << (n_qubits - 1 - bit)
 
+    # the cached array is shared between callers, so make sure nobody edits it
+    permutation.flags.writeable = False
+    return permutation
 
-def unscramble_wavefunction(wavefunction):
+
+def unscramble_wavefunction(wavefunction, out=None):
     """ the state ordering within the wavefunctions (complex numpy array) 
         returned by cirq's simulate() function are not in standard sequential counting order
         (0, 1, 2), but are scrambled
         this function takes a wavefunction of arbitrary qubit legnth, and orders
         the entries in sequential state order
 
+        wavefunction can also be a stack of wavefunctions, shape (moments, 2**n),
+        in which case every row is unscrambled at once
+        the result can be written into an existing array, by passing it as out
+
         see:
           https://quantumai.google/cirq/simulation#qubit_and_amplitude_ordering
     """
     # qubits are listed on the screen with the lowest value qubit at the top
     # (qubit number increases, going down)
-    # write the state as a binary string, then convert to an integer
-    n_states = wavefunction.size
-    scrambled_state_order = []
-
-    # works up to four qubits
-    # ... there is probably an easier/more efficient way of making the list, but this works
-    for q0 in [0, 1]:
-        if n_states == 2:
-            state_string_binary = str(q0)
-            state_integer = int(state_string_binary, 2)  # converts to int
-            scrambled_state_order.append(state_integer)
-        for q1 in [0, 1]:
-            if n_states == 4:
-                state_string_binary = str(q1) + str(q0)
-                state_integer = int(state_string_binary, 2)  # converts to int
-                scrambled_state_order.append(state_integer)
-            for q2 in [0, 1]:
-                if n_states == 8:
-                    state_string_binary = str(q2) + str(q1) + str(q0)
-                    state_integer = int(state_string_binary, 2)  # converts to int
-                    scrambled_state_order.append(state_integer)
-                for q3 in [0, 1]:
-                    if n_states == 16:
-                        state_string_binary = str(q3) + str(q2) + str(q1) + str(q0)
-                        state_integer = int(state_string_binary, 2)  # converts to int
-                        scrambled_state_order.append(state_integer)
-
-    # print(scrambled_state_order)
-    # print(wavefunction)
-
-    # to unscramble, sort the wavefunction (as a list)
-    # by the scrambled_state_order
-
-    # actually unscramble, here
-    wavefunction_unscrambled = [pair[1] for pair in sorted(zip(scrambled_state_order, wavefunction))]
-
-    # convert back to numpy array
-    wavefunction_unscrambled = np.array(wavefunction_unscrambled)
-
-    return wavefunction_unscrambled
-
-
-def illustrate(circuit, labels=None, offset_ends=False):
-
-    # simulate the circuit
-    wavefunctions = make_wavefunction_list(circuit)
-
-    #plt.figure(figsize=[3.7, 10])
-    # find out how big the circuit is,
-    # and create figure with that size
+    # the state order is found by writing the state as a binary string,
+    # and reversing the bits (the permutation is cached, per qubit count)
+    wavefunction = np.asarray(wavefunction)
 
-    # the first line of the circuit starts on line 2 ...
-    # hardcode is somewhat sloppy, maybe change later
-    one_line_html = highlight(circuit).split('<br>')[0]
-    one_line_text = html_to_text(one_line_html)
+    n_states = wavefunction.shape[-1]
+    n_qubits = n_states.bit_length() - 1
+    if n_states != 2**n_qubits:
+        raise ValueError('wavefunction length must be a power of two, got ' + str(n_states))
 
-    circuit_length_chars = len(one_line_text)
-    # print(circuit_length_chars)
+    # actually unscramble, here (one indexing call, along the last axis)
+    return np.take(wavefunction, _unscramble_permutation(n_qubits), axis=-1, out=out)
 
-    # find the start of the circuit
-    # (starts after the qubit name)
-    circuit_start_chars = len(one_line_text.split(': ─')[0]) + 2
-    # really, this should come from the max of checking all lines,
-    # or from the length of the moments themselves,
-    # from when the dragram is first built (better option, but more code)
 
-    chars_to_length = .091  # controls the total size of the graph
+# a sparse wavefunction (see sparsify_wavefunction), keeping only the largest amplitudes
+#   indices are the states kept (in sequential state order, like an unscrambled wavefunction),
+#   amplitudes are their values, and discarded is the total probability left out
+SparseWavefunction = collections.namedtuple(
+    'SparseWavefunction', ['n_qubits', 'indices', 'amplitudes', 'discarded'])
 
-    offset = (circuit_start_chars)  # first plot (in plot units)
-    spacing = 7  # game boards moments (in plot units)
 
-    for w in range(len(wavefunctions)):
-        # find the label for this state, if labels were passed in
-        if labels is not None:
-            label = labels[w]
-        else:
-            label = None
+def sparsify_wavefunction(wavefunction, threshold=1e-6, top_k=None):
+    """ keeps only the amplitudes of an (unscrambled) wavefunction with magnitude
+        at least threshold (by default, the ones draw_amplitude would draw),
+        and, if top_k is given, only the top_k largest of those
+        returns a SparseWavefunction, which also records the probability discarded
+    """
+    wavefunction = np.asarray(wavefunction).reshape(-1)
+    n_qubits = len(wavefunction).bit_length() - 1
+    if len(wavefunction) != 2**n_qubits:
+        raise ValueError('wavefunction length must be a power of two, got ' + str(len(wavefunction)))
+    if top_k is not None and top_k < 1:
+        raise ValueError('top_k must keep at least one amplitude, got ' + str(top_k))
 
-        # scoot the ends slightly, for readability (optional)
-        scoot = 0
-        if offset_ends and w == 0:
-            scoot = -spacing/3
-        if offset_ends and w == len(wavefunctions)-1:
-            scoot = spacing/3
+    magnitudes = np.abs(wavefunction)
+    indices = np.flatnonzero(magnitudes >= threshold)
+    if top_k is not None and len(indices) > top_k:
+        largest = np.argpartition(magnitudes[indices], len(indices) - top_k)[len(indices) - top_k:]
+        indices = np.sort(indices[largest])
 
-        # print(offset+w*spacing)
-        xloc = offset+w*spacing+scoot
-        draw_wavefunction(wavefunctions[w], [xloc, 0], label=label)
+    amplitudes = wavefunction[indices]
+    discarded = np.sum(magnitudes**2) - np.sum(np.abs(amplitudes)**2)
 
-    # set the end of the graph to be just just after the last gameboard
-    # adding "spacing" gives enough room, even if "offset_ends" is True
-    x_end = offset + (w+1)*spacing
+    return SparseWavefunction(n_qubits, indices, amplitudes, max(float(discarded), 0.0))
+
+
+def densify_wavefunction(wavefunction):
+    """ returns the full (unscrambled) wavefunction, for a SparseWavefunction
+        (the discarded amplitudes are zero), other wavefunctions are returned as they are
+    """
+    if not isinstance(wavefunction, SparseWavefunction):
+        return np.asarray(wavefunction)
+
+    dense = np.zeros(2**wavefunction.n_qubits, dtype=wavefunction.amplitudes.dtype)
+    dense[wavefunction.indices] = wavefunction.amplitudes
+    return dense
+
+
+def illustrate(circuit, labels=None, offset_ends=False, ax=None, indent=4, horizontal_spacing=6,
+               state_cache=None):
+    """ draws the wavefunction at every moment of the circuit, below the circuit diagram
+
+        draws on the current pyplot axes, or on ax (a matplotlib Axes), if given
+        indent and horizontal_spacing should match the ones passed to highlight()
+        see illustrate_figure, to draw on a new figure, without using pyplot
+        with a state_cache (a StateCache), only the moments after the longest
+        already simulated prefix of the circuit are simulated (see make_wavefunction_list)
+    """
+    with _stage('illustrate'):
+        _illustrate(circuit, labels, offset_ends, _get_axes(ax), indent, horizontal_spacing,
+                    state_cache)
+
+
+def _illustrate(circuit, labels, offset_ends, ax, indent, horizontal_spacing, state_cache):
+    fig = ax.get_figure()
+
+    # simulate the circuit (the states are added to the batch as they stream in,
+    # and the batch, with the amplitudes of every moment, is drawn at the end)
+    wavefunctions = generate_wavefunctions(circuit, state_cache=state_cache)
+
+    layout = _illustration_layout(circuit, offset_ends, indent, horizontal_spacing)
+
+    # boards and amplitudes of every moment, drawn together at the end
+    # (the simulation runs inside this stage, profiled as its own stages)
+    with _stage('draw', ax):
+        batch = _new_batch()
+
+        for w, wavefunction in enumerate(wavefunctions):
+            # find the label for this state, if labels were passed in
+            if labels is not None:
+                label = labels[w]
+            else:
+                label = None
+
+            draw_wavefunction(wavefunction, [layout.board_x[w], 0], label=label, batch=batch, ax=ax)
+
+        _draw_batch(batch, ax)
+
+    x_end = layout.x_end
     # plt.tight_layout()
-    plt.gca().set_xlim([0, x_end])
+    ax.set_xlim([0, x_end])
     #plt.gca().set_ylim([None, 2*np.sqrt(2)+.1])
 
     # print(plt.gca().get_xlim())
@@ -138,77 +180,568 @@ def illustrate(circuit, labels=None, offset_ends=False):
     # but the y height is calculated from the aspect ratio
     # plt.tight_layout()
 
-    plt.tight_layout()  # needed for savefig to have the correct margin
+    with _stage('tight_layout'):
+        fig.tight_layout()  # needed for savefig to have the correct margin
 
-    figsize_x = circuit_length_chars * chars_to_length
-    y_scale = (plt.gca().get_ylim()[1]-plt.gca().get_ylim()[0]) / x_end
+    figsize_x = layout.width
+    y_scale = (ax.get_ylim()[1]-ax.get_ylim()[0]) / x_end
     figsize_y = figsize_x * y_scale
 
-    plt.gcf().set_size_inches([figsize_x, figsize_y], forward=True)
+    fig.set_size_inches([figsize_x, figsize_y], forward=True)
 
     # sets the facecolor (actually, background) to white, on saves
-    plt.rcParams['figure.facecolor'] = 'white'
+    # (only for this figure, the global rcParams are left alone)
+    fig.set_facecolor('white')
+
+
+# where illustrate puts the gameboards (see _illustration_layout)
+#   board_x is the x location of each board (one per wavefunction), in plot units,
+#   x_end is the end of the graph, and width is the (physical) figure width, in inches
+IllustrationLayout = collections.namedtuple('IllustrationLayout', ['board_x', 'x_end', 'width'])
+
+
+def _illustration_layout(circuit, offset_ends=False, indent=4, horizontal_spacing=6):
+    """ lines the gameboards up with the circuit diagram, returns an IllustrationLayout """
+
+    # find out how big the circuit is (from the same diagram highlight() draws),
+    # and create figure with that size
+    with _stage('layout'):
+        diagram = to_circuit_diagram(circuit, horizontal_spacing=horizontal_spacing)
+
+    # the diagram starts indent characters in, plus one character of margin
+    # (the newline that starts the highlighted html)
+    margin = indent + 1
+    circuit_length_chars = margin + max(len(line) for line in diagram.lines)
+
+    # the first board is at the start of the circuit (after the qubit names),
+    # then one board just after each moment
+    board_x = [margin + diagram.circuit_start]
+    board_x += [margin + end for start, end in diagram.moment_spans]
+
+    chars_to_length = .091  # controls the total size of the graph
+
+    spacing = 7  # game boards moments (in plot units)
+
+    # scoot the ends slightly, for readability (optional)
+    if offset_ends:
+        board_x[0] -= spacing/3
+        board_x[-1] += spacing/3
+
+    # set the end of the graph to be just just after the last gameboard
+    # adding "spacing" gives enough room, even if "offset_ends" is True
+    x_end = margin + (diagram.moment_spans[-1][1] if diagram.moment_spans
+                      else diagram.circuit_start) + spacing
+
+    return IllustrationLayout(board_x, x_end, circuit_length_chars * chars_to_length)
+
+
+def illustrate_figure(circuit, labels=None, offset_ends=False, indent=4, horizontal_spacing=6,
+                      state_cache=None):
+    """ illustrates the circuit (see illustrate) on a new matplotlib Figure, and returns it
+
+        the figure is backed by Agg, and never registered with pyplot,
+        so it can be made (and saved, with fig.savefig) from any thread or process,
+        and is freed when it is no longer referenced
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    illustrate(circuit, labels=labels, offset_ends=offset_ends, ax=fig.add_subplot(),
+               indent=indent, horizontal_spacing=horizontal_spacing, state_cache=state_cache)
+    return fig
+
+
+def illustrate_sweep(circuit, sweep, ncols=1, offset_ends=False, indent=4, horizontal_spacing=6,
+                     path=None):
+    """ illustrates the circuit for every value of a parameter sweep (a cirq.Sweep,
+        such as cirq.Linspace('alpha', 0, np.pi, 5), or a list of resolvers),
+        as a grid of small illustrations (ncols per row), on a new matplotlib Figure
+
+        every value is simulated together, in one batched pass (see make_sweep_wavefunctions),
+        and all the boards are drawn at once, so the grid can be saved with a single savefig
+        (or written straight to path, if given)
+        returns the figure
+    """
+    import cirq
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    resolvers = list(cirq.to_resolvers(sweep))
+    wavefunctions = make_sweep_wavefunctions(circuit, resolvers)
+
+    layout = _illustration_layout(circuit, offset_ends, indent, horizontal_spacing)
+    geometry = wavefunction_geometry(len(circuit.all_qubits()))
+
+    # each illustration is a cell of the grid, with its parameter values written above it
+    board_top = np.max(geometry.segments[..., 1])
+    board_bottom = np.min(geometry.segments[..., 1])
+    row_height = board_top - board_bottom + 4
+
+    fig = Figure()
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot()
+
+    with _stage('draw', ax):
+        batch = _new_batch()
+        for i, (resolver, states) in enumerate(zip(resolvers, wavefunctions)):
+            row, col = divmod(i, ncols)
+            x0, y0 = col*layout.x_end, -row*row_height
+
+            for w, state in enumerate(states):
+                draw_wavefunction(state, [x0 + layout.board_x[w], y0], batch=batch, ax=ax)
+
+            title = ', '.join('%s = %.3g' % (name, value) for name, value in resolver.param_dict.items())
+            ax.text(x0 + layout.board_x[0], y0 + board_top + 1, title,
+                    horizontalalignment='left', verticalalignment='bottom')
+            ax.plot(x0 + layout.board_x[0], y0 + board_top + 2.5, alpha=0)  # room for the title
+
+        _draw_batch(batch, ax)
+
+    # same sizing as illustrate, for ncols illustrations side by side
+    x_end = ncols*layout.x_end
+    ax.set_xlim([0, x_end])
+    with _stage('tight_layout'):
+        fig.tight_layout()
+
+    figsize_x = ncols*layout.width
+    figsize_y = figsize_x * (ax.get_ylim()[1]-ax.get_ylim()[0]) / x_end
+    fig.set_size_inches([figsize_x, figsize_y], forward=True)
+    fig.set_facecolor('white')
+
+    if path is not None:
+        with _stage('savefig'):
+            fig.savefig(path, metadata={'Date': None} if path.endswith('.svg') else None)
+
+    return fig
+
 
+def _get_axes(ax=None):
+    """ returns ax, or the current pyplot axes, if ax is None """
+    if ax is None:
+        import matplotlib.pyplot as plt
+        return plt.gca()
+    return ax
 
-def pprint(circuit, title=None, indent=4, horizontal_spacing=6):
-    diagram = highlight(circuit, title=title, indent=4, horizontal_spacing=6)
-    display(HTML(diagram))
 
+def illustrate_svg(circuit, labels=None, offset_ends=False, indent=4, horizontal_spacing=6,
+                   cache=None, native=True):
+    """ illustrates the circuit (see illustrate), and returns the illustration as an svg string
 
-def highlight(circuit, title=None, indent=4, horizontal_spacing=6):
+        by default, the svg is written directly (see write_illustration_svg),
+        with native=False, it is the matplotlib figure (see illustrate_figure), saved as svg
+        if cache (a RenderCache) is given, the svg is looked up there first
+        (note a circuit with measurements is then only simulated once,
+        so every call returns the same measurement outcome)
+    """
+    if cache is not None:
+        key = circuit_fingerprint(circuit, 'illustrate',
+                                  labels=labels,
+                                  offset_ends=offset_ends,
+                                  indent=indent,
+                                  horizontal_spacing=horizontal_spacing,
+                                  native=native) + '.svg'
+        return cache.get_or_render(key, lambda: illustrate_svg(circuit, labels, offset_ends,
+                                                               indent, horizontal_spacing,
+                                                               native=native))
+
+    if native:
+        return write_illustration_svg(circuit, labels=labels, offset_ends=offset_ends,
+                                      indent=indent, horizontal_spacing=horizontal_spacing)
+
+    fig = illustrate_figure(circuit, labels=labels, offset_ends=offset_ends,
+                            indent=indent, horizontal_spacing=horizontal_spacing)
+    svg = io.StringIO()
+    with _stage('savefig'):
+        fig.savefig(svg, format='svg', metadata={'Date': None})
+    return svg.getvalue()
+
+
+def write_illustration_svg(circuit, labels=None, offset_ends=False, indent=4, horizontal_spacing=6,
+                           state_cache=None, tol=1e-6):
+    """ illustrates the circuit, with the same layout as illustrate, and returns it as an
+        svg string, written directly (without matplotlib, so it is small and fast)
+
+        the gameboard is defined once (in <defs>), and placed with <use> for every moment,
+        each amplitude is a <circle>, with its dial as a <line>
+    """
+    with _stage('write_svg'):
+        return _write_illustration_svg(circuit, labels, offset_ends, indent, horizontal_spacing,
+                                       state_cache, tol)
+
+
+def _write_illustration_svg(circuit, labels, offset_ends, indent, horizontal_spacing,
+                            state_cache, tol):
+    import matplotlib
+
+    layout = _illustration_layout(circuit, offset_ends, indent, horizontal_spacing)
+    x_end = layout.x_end
+
+    # the figure is as wide as the graph, so one point (of line width, or font size)
+    # is this many plot units
+    pt = x_end / (72*layout.width)
+
+    geometry = wavefunction_geometry(len(circuit.all_qubits()))
+
+    amplitudes = []
+    locations = []
+    for w, wavefunction in enumerate(generate_wavefunctions(circuit, state_cache=state_cache)):
+        scaled = geometry.amplitude_scales*wavefunction
+        visible = np.abs(scaled) >= tol
+        amplitudes.append(scaled[visible])
+        locations.append(geometry.centers[visible] + [layout.board_x[w], 0])
+    amplitudes = np.concatenate(amplitudes)
+    locations = np.concatenate(locations).reshape(-1, 2)
+    r = np.abs(amplitudes)
+    p = np.angle(amplitudes)
+
+    board_labels = []
+    if labels is not None:
+        board_labels = [(x + geometry.label[0], geometry.label[1], label)
+                        for x, label in zip(layout.board_x, labels) if label]
+
+    # the height of the graph, from the boards, the disks and the labels
+    # (plus 5% on each side, like matplotlib's autoscaling)
+    y = np.concatenate([geometry.segments[..., 1].reshape(-1),
+                        locations[:, 1] - r, locations[:, 1] + r,
+                        [label_y for x, label_y, label in board_labels]])
+    y_min, y_max = np.min(y), np.max(y)
+    y_min, y_max = y_min - .05*(y_max - y_min), y_max + .05*(y_max - y_min)
+
+    svg = ['<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink"'
+           ' width="%spt" height="%spt" viewBox="0 %s %s %s">' % (
+               _svg_numbers(72*layout.width), _svg_numbers(72*layout.width*(y_max - y_min)/x_end),
+               _svg_numbers(-y_max), _svg_numbers(x_end), _svg_numbers(y_max - y_min)),
+           '<rect x="0" y="%s" width="%s" height="%s" fill="white"/>' % (
+               _svg_numbers(-y_max), _svg_numbers(x_end), _svg_numbers(y_max - y_min))]
+
+    # the gameboard, one path per color and line width (y is flipped, svg y goes down)
+    svg.append('<defs><g id="board" fill="none" stroke-linecap="square">')
+    styles = {}
+    for segment, color, width in zip(geometry.segments, geometry.segment_colors,
+                                     geometry.segment_widths):
+        styles.setdefault((color, width), []).append(segment)
+    for (color, width), segments in styles.items():
+        points = _svg_numbers(np.array(segments)*[1, -1]).reshape(-1, 4)
+        path = ''.join('M%s %sL%s %s' % tuple(segment) for segment in points)
+        svg.append('<path d="%s" stroke="%s" stroke-width="%s"/>' % (
+            path, matplotlib.colors.to_hex(color), _svg_numbers(width*pt)))
+    svg.append('</g></defs>')
+
+    svg.extend('<use xlink:href="#board" x="%s"/>' % x for x in _svg_numbers(layout.board_x))
+
+    # the disks (colored by phase), then the dials on top
+    colors = matplotlib.colormaps['twilight'](.5 + p/(2*np.pi))
+    hex_colors = ['#%02x%02x%02x' % tuple(rgb) for rgb in np.round(255*colors[:, :3]).astype(int)]
+    cx, cy = _svg_numbers(locations[:, 0]), _svg_numbers(-locations[:, 1])
+    svg.append('<g stroke="#000000" fill-opacity=".8" stroke-opacity=".8">')
+    svg.extend('<circle cx="%s" cy="%s" r="%s" fill="%s" stroke-width="%s"/>' % circle
+               for circle in zip(cx, cy, _svg_numbers(r), hex_colors, _svg_numbers(r*pt)))
+    svg.append('</g>')
+
+    dial_x = _svg_numbers(locations[:, 0] + r*np.cos(p))
+    dial_y = _svg_numbers(-(locations[:, 1] + r*np.sin(p)))
+    svg.append('<g stroke="#000000" stroke-linecap="square">')
+    svg.extend('<line x1="%s" y1="%s" x2="%s" y2="%s" stroke-width="%s"/>' % dial
+               for dial in zip(cx, cy, dial_x, dial_y, _svg_numbers(r*pt)))
+    svg.append('</g>')
+
+    # the labels, below the boards
+    svg.append('<g font-family="DejaVu Sans, sans-serif" font-size="%s">' % _svg_numbers(10*pt))
+    svg.extend('<text x="%s" y="%s">%s</text>' % (_svg_numbers(x), _svg_numbers(-label_y),
+                                                  _svg_label(label))
+               for x, label_y, label in board_labels)
+    svg.append('</g>')
+
+    svg.append('</svg>')
+    return '\n'.join(svg) + '\n'
+
+
+def _svg_numbers(values):
+    """ formats numbers for svg (3 decimals, no trailing zeros), works on arrays too """
+    formatted = np.char.rstrip(np.char.rstrip(np.char.mod('%.3f', values), '0'), '.')
+    formatted = np.where(formatted == '-0', '0', formatted)
+    return formatted if formatted.ndim else str(formatted)
+
+
+# greek letters used in mathtext labels (like '$\\psi_0$'), and their unicode characters
+_greek_letters = {name: chr(code) for name, code in [
+    ('alpha', 945), ('beta', 946), ('gamma', 947), ('delta', 948), ('epsilon', 949),
+    ('theta', 952), ('lambda', 955), ('mu', 956), ('pi', 960), ('rho', 961), ('sigma', 963),
+    ('tau', 964), ('phi', 966), ('chi', 967), ('psi', 968), ('omega', 969),
+    ('Gamma', 915), ('Delta', 916), ('Theta', 920), ('Lambda', 923), ('Pi', 928),
+    ('Sigma', 931), ('Phi', 934), ('Psi', 936), ('Omega', 937)]}
+_mathtext_pattern = re.compile(r'\\([A-Za-z]+)|([_^])(?:\{([^}]*)\}|(.))|([^\\_^]+)')
+
+
+def _svg_label(label):
+    """ svg text (escaped) for a label, with simple mathtext ($...$, greek letters,
+        subscripts and superscripts) converted to unicode and <tspan>s """
+    label = str(label)
+    if not (len(label) > 1 and label.startswith('$') and label.endswith('$')):
+        return html.escape(label)
+    return '<tspan font-style="italic">' + _svg_mathtext(label[1:-1]) + '</tspan>'
+
+
+def _svg_mathtext(text):
+    svg = []
+    for command, script, group, character, plain in _mathtext_pattern.findall(text):
+        if command:
+            svg.append(html.escape(_greek_letters.get(command, command)))
+        elif script:
+            shift = 'sub' if script == '_' else 'super'
+            svg.append('<tspan baseline-shift="%s" font-size="70%%">%s</tspan>' % (
+                shift, _svg_mathtext(group or character)))
+        else:
+            svg.append(html.escape(plain))
+    return ''.join(svg)
+
+
+def animate(circuit, path, fps=2, dpi=100, labels=None, state_cache=None, tol=1e-6):
+    """ writes an animation of the circuit running, one frame per moment, to path
+        (a .gif, written with pillow, or an .mp4, which needs ffmpeg)
+
+        a single gameboard is drawn once, then only the amplitudes (and the label,
+        by default the moment number) are redrawn over it for every frame (blitting),
+        and the states are streamed from the simulator, one frame at a time
+        returns the number of frames written
+    """
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.collections import LineCollection, PolyCollection
+    from matplotlib.figure import Figure
+
+    geometry = wavefunction_geometry(len(circuit.all_qubits()))
+    n_frames = len(circuit) + 1
+
+    # figure, with room for the board, the disks which poke out of it, and the label
+    x_min, y_min = np.min(geometry.segments, axis=(0, 1)) - 1
+    x_max, y_max = np.max(geometry.segments, axis=(0, 1)) + 1
+    y_min = min(y_min, geometry.label[1] - 1)
+    width = 3 + .2*(x_max - x_min)
+    height = width*(y_max - y_min)/(x_max - x_min)
+
+    fig = Figure(figsize=(width, height), dpi=dpi)
+    canvas = FigureCanvasAgg(fig)
+    fig.set_facecolor('white')
+    ax = fig.add_axes([0, 0, 1, 1])
+    ax.set_axis_off()
+    ax.set_xlim(x_min, x_max)
+    ax.set_ylim(y_min, y_max)
+
+    # the (static) board
+    ax.add_collection(LineCollection(geometry.segments,
+                                     colors=geometry.segment_colors,
+                                     linewidths=geometry.segment_widths,
+                                     capstyle='projecting'))
+
+    # the (animated) amplitudes and label, same style as draw_amplitudes
+    disks = PolyCollection([], edgecolors='black', alpha=.8, zorder=1e3, animated=True)
+    dials = LineCollection([], colors='black', capstyle='projecting', zorder=2e3, animated=True)
+    ax.add_collection(disks)
+    ax.add_collection(dials)
+    text = ax.text(*geometry.label, '', horizontalalignment='left',
+                   verticalalignment='bottom', animated=True)
+
+    canvas.draw()
+    background = canvas.copy_from_bbox(fig.bbox)
+    frame_size = canvas.get_width_height()
+
+    frames = _frame_writer(path, frame_size, fps)
+    try:
+        for w, wavefunction in enumerate(generate_wavefunctions(circuit, state_cache=state_cache)):
+            r, colors, disk_verts, dial_segments = _amplitude_shapes(
+                geometry.amplitude_scales*wavefunction, geometry.centers, tol)
+            disks.set_verts(disk_verts)
+            disks.set_facecolor(colors)
+            disks.set_linewidths(r)
+            dials.set_segments(dial_segments)
+            dials.set_linewidths(r)
+            text.set_text(labels[w] if labels is not None else '%d / %d' % (w, n_frames - 1))
+
+            canvas.restore_region(background)
+            for artist in (disks, dials, text):
+                ax.draw_artist(artist)
+            frames.write(canvas.buffer_rgba())
+    finally:
+        frames.close()
+
+    return n_frames
+
+
+def _frame_writer(path, frame_size, fps):
+    """ returns a writer for the (rgba) frames of an animation, .gif or .mp4 """
+    extension = os.path.splitext(path)[1].lower()
+    if extension == '.gif':
+        return _GifFrames(path, frame_size, fps)
+    if extension == '.mp4':
+        return _FFMpegFrames(path, frame_size, fps)
+    raise ValueError('animations can be written to .gif or .mp4, got ' + str(path))
+
+
+class _GifFrames:
+    """ collects frames (as small, palette images), and writes the gif when closed """
+
+    def __init__(self, path, frame_size, fps):
+        self.path = path
+        self.frame_size = frame_size
+        self.duration = 1000/fps
+        self.frames = []
+
+    def write(self, rgba):
+        from PIL import Image
+        image = Image.frombuffer('RGBA', self.frame_size, bytes(rgba), 'raw', 'RGBA', 0, 1)
+        self.frames.append(image.convert('RGB').quantize(method=Image.Quantize.FASTOCTREE))
+
+    def close(self):
+        if self.frames:
+            self.frames[0].save(self.path, save_all=True, append_images=self.frames[1:],
+                                duration=self.duration, loop=0)
+
+
+class _FFMpegFrames:
+    """ pipes raw frames into ffmpeg, as they are drawn (nothing is kept in memory) """
+
+    def __init__(self, path, frame_size, fps):
+        import matplotlib
+
+        command = [matplotlib.rcParams['animation.ffmpeg_path'], '-y', '-loglevel', 'error',
+                   '-f', 'rawvideo', '-pix_fmt', 'rgba', '-s', '%dx%d' % frame_size,
+                   '-r', str(fps), '-i', '-',
+                   # h264 needs even sizes
+                   '-vf', 'pad=ceil(iw/2)*2:ceil(ih/2)*2:color=white',
+                   '-vcodec', 'libx264', '-pix_fmt', 'yuv420p', path]
+        try:
+            self.process = subprocess.Popen(command, stdin=subprocess.PIPE)
+        except FileNotFoundError:
+            raise RuntimeError('writing .mp4 animations needs ffmpeg, which was not found') from None
+
+    def write(self, rgba):
+        self.process.stdin.write(rgba)
+
+    def close(self):
+        self.process.stdin.close()
+        if self.process.wait():
+            raise RuntimeError('ffmpeg failed, with exit code ' + str(self.process.returncode))
+
+
+def pprint(circuit, title=None, indent=4, horizontal_spacing=6, cache=None, window=None, pages=None):
+    """ displays the highlighted circuit (in a notebook)
+        with window (a number of moments), the circuit is displayed in pages of window moments,
+        one at a time as they are highlighted (pages picks which ones, default all),
+        see highlight_windows; the cache is only used for the whole circuit """
+    from IPython.display import display, HTML
+
+    if window is None:
+        diagram = highlight(circuit, title=title, indent=indent, horizontal_spacing=horizontal_spacing,
+                            cache=cache)
+        display(HTML(diagram))
+        return
+
+    for fragment in highlight_windows(circuit, window, title=title, indent=indent,
+                                      horizontal_spacing=horizontal_spacing, pages=pages):
+        display(HTML(fragment))
+
+
+# gate symbols highlighted on the wires, and their (web) colors
+_symbol_styles = {'@': 'color:MediumSlateBlue',
+                  'M': 'background-color:WhiteSmoke;color:Maroon;font-weight:bold'}
+_symbol_pattern = re.compile('(?<=─)([@M])(?=─)')
+
+
+def _highlight_symbol(match):
+    symbol = match.group(1)
+    return '<span style="' + _symbol_styles[symbol] + '">' + symbol + '</span>'
+
+
+def highlight(circuit, title=None, indent=4, horizontal_spacing=6, cache=None):
     """ takes in a circuit (created by cirq), and 
-        returns a snytax-highlighted html string version """
+        returns a snytax-highlighted html string version
+        if cache (a RenderCache) is given, the html is looked up there first """
+
+    if cache is not None:
+        key = circuit_fingerprint(circuit, 'highlight',
+                                  title=title,
+                                  indent=indent,
+                                  horizontal_spacing=horizontal_spacing) + '.html'
+        return cache.get_or_render(key, lambda: highlight(circuit, title, indent, horizontal_spacing))
+
+    # start with the structured diagram;
+    # use the cirq drawer, except with more spacing
+    diagram = to_circuit_diagram(circuit, horizontal_spacing=horizontal_spacing)
 
-    # start by converting to string;
-    # use the cirq function, except with more spacing
-    diagram = to_text_diagram(circuit, horizontal_spacing=horizontal_spacing)
+    return _wrap_highlighted(_highlight_lines(diagram, indent), title)
 
-    # color the qubit names
-    diagram_colored_qubits = ''
 
-    color_index = 0
-    for line in diagram.split('\n'):
-        # add indent to the start of the lines
-        #line = indent*' ' + line
+def highlight_windows(circuit, window=100, title=None, indent=4, horizontal_spacing=6, pages=None):
+    """ generator, highlights a long circuit in windows of (at most) window moments,
+        and yields one html fragment (a <div>, like highlight returns) per window
 
-        # if this is the qubit name, colorize it
-        if line.find(':') > 0:
-            colon_location = line.find(':')
-            c_start = line[:colon_location]  # first part (qubit name)
-            c_end = line[colon_location:]  # second part (includes the colon)
+        every window repeats the qubit names, and is captioned with its moments,
+        the title is only on the first fragment yielded; pages picks which windows to render
+        (their indices, default all of them)
 
-            line = c_start
+        only one window is laid out at a time, so memory stays bounded by the window
+        size (not the circuit length), and the first fragment is ready right away """
+    import cirq
 
-            # line contains code
+    if window < 1:
+        raise ValueError('window must be at least one moment, got ' + str(window))
 
-            color = qubit_cmap[color_index]
-            # print(color)
-           # background-color:powderblue;
+    # the same qubits (and order) in every window, even where some of them are idle
+    qubit_order = cirq.QubitOrder.explicit(cirq.QubitOrder.DEFAULT.order_for(circuit.all_qubits()))
 
-            #cc = '<span style="color:' + color + '">' + c_start + '</span>' + c_end
-            cc = '<span style="background-color:WhiteSmoke;color:' + color + '">' + c_start + '</span>' + c_end
+    n_moments = len(circuit)
+    n_pages = -(-n_moments // window)  # (an empty circuit has no pages)
+    if pages is None:
+        pages = range(n_pages)
 
-            diagram_colored_qubits += indent*' ' + cc
-            color_index += 1
+    for page in pages:
+        if not 0 <= page < n_pages:
+            raise ValueError('page ' + str(page) + ' out of range (the circuit has '
+                             + str(n_pages) + ' pages of ' + str(window) + ' moments)')
 
-            # line = indent*' ' + line # indent
+        start = page*window
+        stop = min(start + window, n_moments)
+        diagram = to_circuit_diagram(circuit[start:stop],
+                                     qubit_order=qubit_order,
+                                     horizontal_spacing=horizontal_spacing)
+
+        caption = indent*' ' + '<span style="color:Gray">moments ' + str(start) + '-' \
+            + str(max(start, stop - 1)) + ' of ' + str(n_moments) + '</span><br>'
+
+        yield _wrap_highlighted(caption + _highlight_lines(diagram, indent), title)
+        title = None
+
+
+def _highlight_lines(diagram, indent=4):
+    """ the lines of a CircuitDiagram as html, with the qubit names and gate symbols colored """
+
+    # the qubit names are colored, by line
+    qubit_lines = dict(zip(diagram.qubit_lines, diagram.qubit_names))
+
+    # color the qubit names and gate symbols, in a single pass over the lines
+    html_lines = []
+    for line_number, line in enumerate(diagram.lines):
+        name = ''
+        if line_number in qubit_lines:
+            name = qubit_lines[line_number]
+            color = _qubit_color(diagram.qubit_lines.index(line_number))
+            # background-color:powderblue;
+            html_lines.append(indent*' ' + '<span style="background-color:WhiteSmoke;color:'
+                              + color + '">' + html.escape(name, quote=False) + '</span>')
         else:
-            # line contains no code, just add it back
-            #line = indent*' ' + line
-            diagram_colored_qubits += indent*' ' + line
+            html_lines.append(indent*' ')
 
-        diagram_colored_qubits += '<br>'
+        html_lines.append(_symbol_pattern.sub(_highlight_symbol,
+                                              html.escape(line[len(name):], quote=False)))
+        html_lines.append('<br>')
 
-    diagram = diagram_colored_qubits
+    return ''.join(html_lines)
 
-    # use web colors
 
-    # color @ symbol
-    diagram = diagram.replace('─@─', '─<span style="color:MediumSlateBlue">@</span>─')
-    # color M symbol
-    diagram = diagram.replace(
-        '─M─', '─<span style="background-color:WhiteSmoke;color:Maroon;font-weight:bold">M</span>─')
-    # <span style="color:green;font-weight:bold">@</span>
+def _wrap_highlighted(diagram, title=None):
+    """ adds the title, and wraps the highlighted lines in <pre> and <div> blocks """
 
     # add the title, last
     if title is not None:
@@ -233,12 +766,12 @@ def highlight(circuit, title=None, indent=4, horizontal_spacing=6):
 
 
 def to_text_diagram(
-        cir: cirq.Circuit,
+        cir: 'cirq.Circuit',
         use_unicode_characters: bool = True,
         transpose: bool = False,
         include_tags: bool = True,
         precision=3,
-        qubit_order: 'cirq.QubitOrderOrList' = cirq.ops.QubitOrder.DEFAULT,
+        qubit_order: 'cirq.QubitOrderOrList' = None,
         horizontal_spacing=3,) -> str:
     """ function modified from Google Cirq (added horizontal_spacing)
         original at x
@@ -251,11 +784,17 @@ def to_text_diagram(
         transpose: Arranges qubit wires vertically instead of horizontally.
         include_tags: Whether tags on TaggedOperations should be printed
         precision: Number of digits to display in text diagram
-        qubit_order: Determines how qubits are ordered in the diagram.
+        qubit_order: Determines how qubits are ordered in the diagram
+            (by default, cirq.QubitOrder.DEFAULT).
 
     Returns:
         The text diagram.
     """
+    import cirq
+
+    if qubit_order is None:
+        qubit_order = cirq.QubitOrder.DEFAULT
+
     # JD make the diagram (like a a canvas)
     # diagram = self.to_text_diagram_drawer(
     diagram = cir.to_text_diagram_drawer(
@@ -278,21 +817,140 @@ def to_text_diagram(
     )
 
 
+# structured version of the text diagram, shared by highlight() and illustrate()
+#   lines are the rendered text lines (same text as to_text_diagram),
+#   qubit_names and qubit_lines are the name and line number of each qubit wire,
+#   moment_spans are the (start, end) character columns of each moment,
+#   and circuit_start is the character column where the wires start (after the names)
+CircuitDiagram = collections.namedtuple(
+    'CircuitDiagram',
+    ['lines', 'qubit_names', 'qubit_lines', 'moment_spans', 'circuit_start'])
+
+
+def to_circuit_diagram(
+        cir: 'cirq.Circuit',
+        use_unicode_characters: bool = True,
+        include_tags: bool = True,
+        precision=3,
+        qubit_order: 'cirq.QubitOrderOrList' = None,
+        horizontal_spacing=3,) -> CircuitDiagram:
+    """ renders the circuit like to_text_diagram, and returns it as a CircuitDiagram,
+        recording where each qubit row and moment column ended up in the text
+
+        the positions come from cirq's TextDiagramDrawer (the same rules its
+        render() uses to size the blocks), so they are exact
+    """
+    import cirq
+
+    if qubit_order is None:
+        qubit_order = cirq.QubitOrder.DEFAULT
+
+    drawer = cir.to_text_diagram_drawer(
+        use_unicode_characters=use_unicode_characters,
+        include_tags=include_tags,
+        precision=precision,
+        qubit_order=qubit_order,
+    )
+
+    # a circuit without qubits draws nothing at all
+    if not cir.all_qubits():
+        return CircuitDiagram([], [], [], [], 0)
+
+    lines = drawer.render(
+        crossing_char=(None if use_unicode_characters else '|'),
+        horizontal_spacing=horizontal_spacing,
+        use_unicode_characters=use_unicode_characters,
+    ).split('\n')
+
+    # the diagram is drawn on a grid of blocks, entries are at the even blocks
+    # and the padding between entries is at the odd blocks
+    # find the size of every block, then where each block starts (in characters/lines)
+    widths = collections.defaultdict(int)
+    heights = collections.defaultdict(int)
+
+    for x in range(drawer.width() - 1):
+        widths[2*x] = 1
+        widths[2*x+1] = int(np.ceil(drawer.horizontal_padding.get(x, horizontal_spacing)))
+    for y in range(drawer.height() - 1):
+        heights[2*y] = 1
+        heights[2*y+1] = int(np.floor(drawer.vertical_padding.get(y, 1)))
+
+    for (x, y), entry in drawer.entries.items():
+        entry_lines = entry.text.split('\n')
+        widths[2*x] = max(widths[2*x], max(len(line) for line in entry_lines))
+        if entry.text:
+            heights[2*y] = max(heights[2*y], len(entry_lines))
+    for line in drawer.vertical_lines:
+        widths[int(line.x*2)] = max(widths[int(line.x*2)], 1)
+    for line in drawer.horizontal_lines:
+        heights[int(line.y*2)] = max(heights[int(line.y*2)], 1)
+
+    def block_starts(sizes):
+        # running total of the block sizes, so block_starts(sizes)[b] is where block b starts
+        return [0] + list(itertools.accumulate(sizes[b] for b in range(max(sizes) + 1)))
+
+    x_starts = block_starts(widths)
+    y_starts = block_starts(heights)
+
+    # qubit names are the first entries in column 0 (other names are classical bits)
+    qubits = cirq.QubitOrder.as_qubit_order(qubit_order).order_for(cir.all_qubits())
+    name_rows = sorted(y for (x, y), entry in drawer.entries.items() if x == 0 and entry.text)
+    name_rows = name_rows[:len(qubits)]
+
+    qubit_names = [drawer.entries[0, y].text[:-len(': ')] for y in name_rows]
+
+    # a row with a taller entry (such as a CircuitOperation) is several lines high,
+    # and the wire (and its name) is on one of them, find which
+    qubit_lines = []
+    for name, y in zip(qubit_names, name_rows):
+        block_lines = range(y_starts[2*y], y_starts[2*y + 1])
+        qubit_lines.append(next((line for line in block_lines if lines[line].startswith(name + ':')),
+                                y_starts[2*y]))
+
+    # the columns of a moment are drawn with their padding forced to zero,
+    # so a new moment starts after every column without forced padding
+    # (the last column has no padding, and ends the last moment)
+    moment_spans = []
+    x = 1
+    for _ in range(len(cir)):
+        x_first = x
+        while x < drawer.width() - 1 and drawer.horizontal_padding.get(x) == 0:
+            x += 1
+        moment_spans.append((x_starts[2*x_first], x_starts[2*x + 1]))
+        x += 1
+
+    return CircuitDiagram(lines, qubit_names, qubit_lines, moment_spans, widths[0])
+
+
 def normalize_state(state):
     """ normalizes the the amplitude of an input state
         (numpy array, representing quantum mechanical state)
         and normalizes it so that the total probabilty of the state is 1
+        (a SparseWavefunction is normalized over the amplitudes it kept)
     """
+    if isinstance(state, SparseWavefunction):
+        return state._replace(amplitudes=normalize_state(state.amplitudes))
     return state / np.sqrt(np.sum(np.abs(state)**2))
 
 
+@functools.lru_cache(maxsize=None)
+def _unit_circle(n_points=100):
+    """ returns the (read-only) vertices of a unit circle, shape (n_points, 2),
+        shared by every amplitude disk """
+    angles = np.linspace(0, 2*np.pi, n_points)
+    circle = np.stack([np.cos(angles), np.sin(angles)], axis=-1)
+    circle.flags.writeable = False
+    return circle
+
+
 #
 # autopep8 does not break this line
 #
 def draw_amplitude(amplitude,
                    location=[0, 0],
                    border_color='black',
-                   tol=1e-6):
+                   tol=1e-6,
+                   ax=None):
     """ Draws an amplitude between [0,1]
         as a disk with area between [0,π].
         If amplitude is a string, the value of the string will be displayed instead,
@@ -302,301 +960,293 @@ def draw_amplitude(amplitude,
         The box can be None, 'r' for rectangle, or 'd' for diamond.
         By convention, the box is drawn so that the maximum amplitude
         touches the corners of the box (no whitespace inside),
-        meaning boxes have length of 2, measured diagonally """
+        meaning boxes have length of 2, measured diagonally
 
-    plt.gca().set_aspect(1)
-    plt.axis('off')
+        To draw many amplitudes at once, use draw_amplitudes (much faster) """
 
-    # get amplitude and phase [-π,π], real numbers
-    r = np.abs(amplitude)
-    p = cmath.phase(amplitude)
+    draw_amplitudes([amplitude], [location], tol=tol, ax=ax)
 
-    if r < tol:
-        # radius is too small, nothing to plot
-        return
+    return None
 
-    # find a color to correspond to this phase
-    # use 'twilight' or 'twilight_shifted' which are cyclic
-    p01 = .5 + p/(2*np.pi)  # phase, scaled zero to one, for twilight color map
-    cmap = plt.get_cmap('twilight')
-    color = cmap(p01)
 
-    # draw the circle (outline and fill)
-    angles = np.linspace(0, np.pi)
-    x = r*np.cos(angles)
-    y = r*np.sin(angles)
+def draw_amplitudes(amplitudes, locations, tol=1e-6, ax=None):
+    """ Draws many amplitudes at once, as disks with dials (see draw_amplitude).
 
-    # draw this disk and dial with a high zorder,
-    # so probabilites will be drawn on top of the game board
+        amplitudes is an array of complex numbers, shape (N,),
+        and locations are the centers of the disks, shape (N, 2).
+        Radius, phase color and dial endpoints are all computed as arrays,
+        and drawn as just two artists: one PolyCollection for the disks,
+        and one LineCollection for the dials.
+        Draws on the current pyplot axes, or on ax, if given.
+    """
+    from matplotlib.collections import LineCollection, PolyCollection
+
+    ax = _get_axes(ax)
+    ax.set_aspect(1)
+    ax.set_axis_off()
+
+    r, colors, disks, dials = _amplitude_shapes(amplitudes, locations, tol)
+
+    # radius is too small, nothing to plot
+    if not len(r):
+        return None
 
-    plt.fill_between(location[0]+x,
-                     location[1]+y,
-                     location[1]-y,
-                     color=color,
-                     alpha=.8,
-                     linewidth=r,
-                     edgecolor='black',
-                     zorder=1e3)  # fill
-
-    # draw the dial
-    dial_end = (location[0]+r*np.cos(p), location[1]+r*np.sin(p))
-    plt.plot((location[0], dial_end[0]),
-             (location[1], dial_end[1]),
-             color='black',
-             linewidth=r,
-             zorder=2e3)
+    # draw the disks and dials with a high zorder,
+    # so probabilites will be drawn on top of the game board
+    ax.add_collection(PolyCollection(disks,
+                                     facecolors=colors,
+                                     edgecolors='black',
+                                     alpha=.8,
+                                     linewidths=r,
+                                     zorder=1e3))  # fill
+
+    ax.add_collection(LineCollection(dials,
+                                     colors='black',
+                                     linewidths=r,
+                                     capstyle='projecting',
+                                     zorder=2e3))
+    ax.autoscale_view()
 
     return None
 
 
-def draw_wavefunction(state=None,
-                      location=[0, 0],
-                      layout=None,
-                      border_color=None,
-                      scale=1.0,
-                      label=None):
-    """ there is likely a better way to deal with all the gameboard types,
-        but this works for now """
-    if len(state) == 2:
-        draw_wavefunction2(state=state,
-                           location=location,
-                           layout=layout,
-                           border_color=border_color,
-                           scale=scale,
-                           label=label)
-    elif len(state) == 4:
-        draw_wavefunction4(state=state,
-                           location=location,
-                           layout=layout,
-                           border_color=border_color,
-                           scale=scale,
-                           label=label)
-    elif len(state) == 8:
-        draw_wavefunction8(state=state,
-                           location=location,
-                           layout=layout,
-                           border_color=border_color,
-                           scale=scale,
-                           label=label)
-    elif len(state) == 16:
-        draw_wavefunction16(state=state,
-                            location=location,
-                            layout=layout,
-                            border_color=border_color,
-                            scale=scale,
-                            label=label)
-
-
-def draw_wavefunction2(state=None,
-                       location=[0, 0],
-                       layout=None,
-                       border_color=None,
-                       scale=1.0,
-                       label=None):
-    """ draws a 4 dimensional wavefunction, representing the probability (including phase)
-        of being found in a given space in Hilbert space (state space), for two qubits
-        With a scale of 1.0 (default), an amplitude with magnitude 1 in represented as a disk
-        with radius one (full size).
+def _amplitude_shapes(amplitudes, locations, tol=1e-6):
+    """ computes the radius, color, disk and dial of every visible amplitude (see draw_amplitudes),
+        returns arrays of radii (N,), colors (N, 4), disks (N, 100, 2) and dials (N, 2, 2)
     """
-    plt.gca().set_aspect(1)
-    plt.axis('off')
+    import matplotlib
 
-    loc = location
-    s = scale
+    amplitudes = np.asarray(amplitudes, dtype=complex).reshape(-1)
+    locations = np.asarray(locations, dtype=float).reshape(-1, 2)
 
-    # "center to corner" length, for convenience
-    # (the full diamond is twice this value, in width and height)
-    # cc = 2*np.sqrt(2)
+    # get amplitude and phase [-π,π], real numbers
+    r = np.abs(amplitudes)
+    p = np.angle(amplitudes)
 
-    # find the corners of the outside of the box (rectangle)\
-    # (start upper left, go clockwise)
-    corners = []
-    corners.append(np.array([loc[0]-s*1, 0]))  #
-    corners.append(np.array([loc[0]+s*1, 0]))  #
-    corners.append(np.array([loc[0]+s*1, loc[1]-s*4]))  #
-    corners.append(np.array([loc[0]-s*1, loc[1]-s*4]))  #
+    # radius is too small, nothing to plot
+    visible = r >= tol
+    r, p, locations = r[visible], p[visible], locations[visible]
 
-    if border_color is None:
-        border_color = qubit_cmap[0]  # cmap(1)
-
-    # draw the outline of the box
-    plt.plot([corners[0][0], corners[1][0]], [corners[0][1], corners[1][1]],
-             color=border_color, linewidth=s*.5)
-    plt.plot([corners[1][0], corners[2][0]], [corners[1][1], corners[2][1]],
-             color=border_color, linewidth=s*.5)
-    plt.plot([corners[2][0], corners[3][0]], [corners[2][1], corners[3][1]],
-             color=border_color, linewidth=s*.5)
-    plt.plot([corners[3][0], corners[0][0]], [corners[3][1], corners[0][1]],
-             color=border_color, linewidth=s*.5)
-
-    # draw the horizontal line (y, min, xmax)
-    plt.hlines(loc[1]-s*2, loc[0]-s*1, loc[0]+s*1,
-               color=border_color, linewidth=s*.2)
-
-    # draw the amplitudes
-    # TODO - check (check with scale)
-    draw_amplitude(s*state[0], [loc[0], loc[1]-s])
-    draw_amplitude(s*state[1], [loc[0], loc[1]-3*s])
+    # find a color to correspond to each phase
+    # use 'twilight' or 'twilight_shifted' which are cyclic
+    p01 = .5 + p/(2*np.pi)  # phase, scaled zero to one, for twilight color map
+    cmap = matplotlib.colormaps['twilight']
+    colors = cmap(p01)
 
-    if label is not None:
-        text_loc = (loc[0]-s*.75, loc[1]-6.5*s)
-        plt.text(text_loc[0],
-                 text_loc[1],
-                 label,
-                 horizontalalignment='left',
-                 verticalalignment='bottom')
+    # the disks (outline and fill), a scaled and shifted unit circle for each amplitude
+    disks = locations[:, np.newaxis, :] + r[:, np.newaxis, np.newaxis]*_unit_circle()
 
-        # invisible marker, since python does include text when scaling
-        plt.plot(text_loc[0], text_loc[1], alpha=0)
+    # the dials, from the center out to the edge (in the direction of the phase)
+    dial_ends = locations + r[:, np.newaxis]*np.stack([np.cos(p), np.sin(p)], axis=-1)
+    dials = np.stack([locations, dial_ends], axis=1)
 
+    return r, colors, disks, dials
 
-def draw_wavefunction4(state=None,
-                       location=[0, 0],
-                       layout=None,
-                       border_color=None,
-                       scale=1.0,
-                       label=None):
-    """ draws a 4 dimensional wavefunction, representing the probability (including phase)
-        of being found in a given space in Hilbert space (state space), for two qubits
-        With a scale of 1.0 (default), an amplitude with magnitude 1 in represented as a disk
-        with radius one (full size).
-    """
 
-    plt.gca().set_aspect(1)
-    plt.axis('off')
+# geometry of a gameboard (relative to its location), see wavefunction_geometry
+#   segments are the board lines (outline and dividers), shape (S, 2, 2),
+#   with a color and linewidth for each,
+#   centers are the amplitude locations, shape (2**n, 2), in sequential state order,
+#   and amplitude_scales are the (sub-board) scale of each amplitude
+BoardGeometry = collections.namedtuple(
+    'BoardGeometry',
+    ['segments', 'segment_colors', 'segment_widths', 'centers', 'amplitude_scales', 'label'])
 
-    loc = location
-    s = scale
+# distance from the top of the board to the label, for the original (hand-drawn) boards
+# larger boards put the label just below the lowest sub-board
+_label_depths = {1: 6.5, 2: 6, 3: 11, 4: 21}
 
-    # "center to corner" length, for convenience
-    # (the full diamond is twice this value, in width and height)
-    cc = 2*np.sqrt(2)
 
-    # find the corners of the outside of the box (diamond)
-    corners = []
-    corners.append(np.array([loc[0]+s*cc, loc[1]]))  #
-    corners.append(np.array([loc[0], loc[1]+s*cc]))  #
-    corners.append(np.array([loc[0]-s*cc, loc[1]]))  #
-    corners.append(np.array([loc[0], loc[1]-s*cc]))  #
+def _qubit_color(qubit):
+    """ color for a qubit (colors repeat, for very large circuits) """
+    return qubit_cmap[qubit % len(qubit_cmap)]
 
-    if border_color is None:
-        # this is the two qubit case
 
+def _build_geometry(n_qubits, s, border_color=None):
+    """ builds the board lines and amplitude centers, for n_qubits (centered on the origin)
+
+        one qubit is a rectangle, two qubits are a diamond,
+        each additional qubit stacks a slightly smaller copy
+        of the board below the original (recursively)
+        returns lists of segments, colors, widths, and arrays of centers and scales
+    """
+    if n_qubits == 1:
+        color = border_color or _qubit_color(0)
+
+        # corners of the outside of the box (rectangle),
+        # (start upper left, go clockwise)
+        corners = s*np.array([[-1, 0], [1, 0], [1, -4], [-1, -4]])
+        segments = [corners[[0, 1]], corners[[1, 2]], corners[[2, 3]], corners[[3, 0]],
+                    s*np.array([[-1, -2], [1, -2]])]  # horizontal line
+        colors = 5*[color]
+        widths = 4*[s*.5] + [s*.2]
+        centers = s*np.array([[0, -1], [0, -3]])
+
+    elif n_qubits == 2:
         # (draw blue first, upper left)
-        border_color_a = qubit_cmap[1]  # cmap(1)
-        border_color_b = qubit_cmap[0]  # cmap(0)
+        color_a = border_color or _qubit_color(1)
+        color_b = border_color or _qubit_color(0)
+
+        # "center to corner" length, for convenience
+        # (the full diamond is twice this value, in width and height)
+        cc = 2*np.sqrt(2)
+
+        # corners of the outside of the box (diamond)
+        corners = s*cc*np.array([[1, 0], [0, 1], [-1, 0], [0, -1]])
+        middles = (corners + np.roll(corners, -1, axis=0))/2  # middle of each edge
+        segments = [corners[[0, 1]], corners[[1, 2]], corners[[2, 3]], corners[[3, 0]],
+                    middles[[0, 2]], middles[[1, 3]]]  # the "x" inside
+        colors = [color_a, color_b, color_a, color_b, color_b, color_a]
+        widths = 4*[s*.5] + 2*[s*.2]
+        centers = s*cc/2*np.array([[0, 1], [-1, 0], [1, 0], [0, -1]])
+
     else:
-        border_color_a = border_color
-        border_color_b = border_color
-
-    # draw the outline of the dimond
-    plt.plot([corners[0][0], corners[1][0]], [corners[0][1], corners[1][1]],
-             color=border_color_a, linewidth=s*.5)
-    plt.plot([corners[1][0], corners[2][0]], [corners[1][1], corners[2][1]],
-             color=border_color_b, linewidth=s*.5)
-    plt.plot([corners[2][0], corners[3][0]], [corners[2][1], corners[3][1]],
-             color=border_color_a, linewidth=s*.5)
-    plt.plot([corners[3][0], corners[0][0]], [corners[3][1], corners[0][1]],
-             color=border_color_b, linewidth=s*.5)
-
-    # draw the "x" inside
-    plt.plot([(corners[0][0]+corners[1][0])/2, (corners[2][0]+corners[3][0])/2],
-             [(corners[0][1]+corners[1][1])/2, (corners[2][1]+corners[3][1])/2],
-             color=border_color_b, linewidth=s*.2)
-    plt.plot([(corners[1][0]+corners[2][0])/2, (corners[3][0]+corners[0][0])/2],
-             [(corners[1][1]+corners[2][1])/2, (corners[3][1]+corners[0][1])/2],
-             color=border_color_a, linewidth=s*.2)
-
-    # draw the amplitudes
-    draw_amplitude(s*state[0], [loc[0], loc[1]+s*cc/2])
-    draw_amplitude(s*state[1], [loc[0]-s*cc/2, loc[1]])
-    draw_amplitude(s*state[2], [loc[0]+s*cc/2, loc[1]])
-    draw_amplitude(s*state[3], [loc[0], loc[1]-s*cc/2])
-
-    # if label is not None:
-    #    plt.text(loc[0]-s*.75, loc[1]-5.5*s, label, horizontalalignment='left')
+        # the first half of the states, then the second half (smaller, below)
+        # the second half is moved down by the height of the first half
+        upper = _build_geometry(n_qubits-1, s, border_color)
+        lower = _build_geometry(n_qubits-1, .9*s, border_color or _qubit_color(n_qubits-1))
+        shift = np.array([0, -s*2**(n_qubits-3)*np.sqrt(32)])
 
-    if label is not None:
-        text_loc = (loc[0]-s*.75, loc[1]-6*s)
-        plt.text(text_loc[0],
-                 text_loc[1],
-                 label,
-                 horizontalalignment='left',
-                 verticalalignment='bottom')
+        segments = upper[0] + [segment + shift for segment in lower[0]]
+        colors = upper[1] + lower[1]
+        widths = upper[2] + lower[2]
+        centers = np.concatenate([upper[3], lower[3] + shift])
 
-        # invisible marker, since python does include text when scaling
-        plt.plot(text_loc[0], text_loc[1], alpha=0)
+        return segments, colors, widths, centers, np.concatenate([upper[4], lower[4]])
 
+    return segments, colors, widths, centers, np.full(2**n_qubits, s)
 
-def draw_wavefunction8(state=None,
-                       location=[0, 0],
-                       layout=None,
-                       border_color=None,
-                       scale=1.0,
-                       label=None):
-    loc = location
-    s = scale
 
-    if border_color is None:
-        border_color_a = None
-        border_color_b = qubit_cmap[2]
+@functools.lru_cache(maxsize=64)
+def wavefunction_geometry(n_qubits, scale=1.0):
+    """ computes the gameboard geometry for n_qubits (any number of qubits) as a BoardGeometry,
+        relative to the board location
+        the geometry is cached per (n_qubits, scale), and reused for every board drawn
+    """
+    if n_qubits < 1:
+        raise ValueError('gameboards need at least one qubit, got ' + str(n_qubits))
+
+    segments, colors, widths, centers, amplitude_scales = _build_geometry(n_qubits, scale)
+
+    # the label goes below the board
+    if n_qubits in _label_depths:
+        label_depth = _label_depths[n_qubits]
     else:
-        border_color_a = border_color
-        border_color_b = border_color
+        # (in unscaled units, like the table, scaled below)
+        label_depth = 2.5 - np.min(np.array(segments)[..., 1])/scale
+    label = np.array([-.75*scale, -label_depth*scale])
 
-    # draw first half
-    draw_wavefunction4(state[:4],
-                       location=location,
-                       scale=scale,
-                       border_color=border_color_a)
+    geometry = BoardGeometry(np.array(segments, dtype=float),
+                             tuple(colors),
+                             np.array(widths, dtype=float),
+                             centers.astype(float),
+                             amplitude_scales.astype(float),
+                             label)
 
-    # draw second half
-    draw_wavefunction4(state[4:],
-                       location=[location[0], location[1]-scale*np.sqrt(32)],
-                       scale=scale*.9,
-                       border_color=border_color_b)
+    # the cached arrays are shared between callers, so make sure nobody edits them
+    for array in [geometry.segments, geometry.segment_widths, geometry.centers,
+                  geometry.amplitude_scales, geometry.label]:
+        array.flags.writeable = False
 
-    if label is not None:
-        text_loc = (loc[0]-s*.75, loc[1]-11*s)
-        plt.text(text_loc[0],
-                 text_loc[1],
-                 label,
-                 horizontalalignment='left',
-                 verticalalignment='bottom')
+    return geometry
 
-        # invisible marker, since python does include text when scaling
-        plt.plot(text_loc[0], text_loc[1], alpha=0)
 
+def _new_batch():
+    """ a batch of board lines and amplitudes, to be drawn all at once by _draw_batch """
+    return {'segments': [], 'colors': [], 'widths': [], 'amplitudes': [], 'locations': []}
+
+
+def _draw_batch(batch, ax=None):
+    """ draws the board lines (one LineCollection) and amplitudes (see draw_amplitudes) """
+    from matplotlib.collections import LineCollection
+
+    ax = _get_axes(ax)
+
+    if batch['segments']:
+        ax.add_collection(LineCollection(np.concatenate(batch['segments']),
+                                         colors=batch['colors'],
+                                         linewidths=np.concatenate(batch['widths']),
+                                         capstyle='projecting'))
+        ax.autoscale_view()
+
+    if batch['amplitudes']:
+        draw_amplitudes(np.concatenate(batch['amplitudes']),
+                        np.concatenate(batch['locations']),
+                        ax=ax)
+
+
+def draw_wavefunction(state=None,
+                      location=[0, 0],
+                      layout=None,
+                      border_color=None,
+                      scale=1.0,
+                      label=None,
+                      batch=None,
+                      ax=None):
+    """ draws a wavefunction (of any number of qubits), representing the probability
+        (including phase) of being found in a given space in Hilbert space (state space)
+        With a scale of 1.0 (default), an amplitude with magnitude 1 in represented as a disk
+        with radius one (full size).
+        The board geometry comes from wavefunction_geometry (cached).
+        state can also be a SparseWavefunction (only its amplitudes are drawn).
+
+        if batch is given (see _new_batch), the board lines and amplitudes are added to it
+        (to be drawn later, all at once), otherwise they are drawn right away
+        draws on the current pyplot axes, or on ax, if given """
 
-def draw_wavefunction16(state=None,
-                        location=[0, 0],
-                        layout=None,
-                        border_color=None,
-                        scale=1.0,
-                        label=None):
+    ax = _get_axes(ax)
+    ax.set_aspect(1)
+    ax.set_axis_off()
+
+    if isinstance(state, SparseWavefunction):
+        n_qubits = state.n_qubits
+        indices, state = state.indices, state.amplitudes
+    else:
+        state = np.asarray(state)
+        n_qubits = len(state).bit_length() - 1
+        if len(state) != 2**n_qubits:
+            raise ValueError('wavefunction length must be a power of two, got ' + str(len(state)))
+        indices = slice(None)
+
+    geometry = wavefunction_geometry(n_qubits, scale)
+    loc = np.asarray(location, dtype=float)
+
+    if border_color is None:
+        colors = geometry.segment_colors
+    else:
+        colors = len(geometry.segment_colors)*(border_color,)
 
-    loc = location
-    s = scale
+    draw_now = batch is None
+    if draw_now:
+        batch = _new_batch()
 
-    # draw first half
-    draw_wavefunction8(state[:8], location=location, scale=1)
+    batch['segments'].append(geometry.segments + loc)
+    batch['colors'].extend(colors)
+    batch['widths'].append(geometry.segment_widths)
+    batch['amplitudes'].append(geometry.amplitude_scales[indices]*state)
+    batch['locations'].append(geometry.centers[indices] + loc)
 
-    # draw seconcd half
-    draw_wavefunction8(state[8:],
-                       location=[location[0], location[1]-2*np.sqrt(32)],
-                       scale=.9,
-                       border_color=qubit_cmap[3])
+    if draw_now:
+        _draw_batch(batch, ax)
 
     if label is not None:
-        text_loc = (loc[0]-s*.75, loc[1]-21*s)
-        plt.text(text_loc[0],
-                 text_loc[1],
-                 label,
-                 horizontalalignment='left',
-                 verticalalignment='bottom')
+        text_loc = loc + geometry.label
+        ax.text(text_loc[0],
+                text_loc[1],
+                label,
+                horizontalalignment='left',
+                verticalalignment='bottom')
 
         # invisible marker, since python does include text when scaling
-        plt.plot(text_loc[0], text_loc[1], alpha=0)
+        ax.plot(text_loc[0], text_loc[1], alpha=0)
+
+
+# the older, per size drawing functions (for 1 to 4 qubits), kept for existing code,
+# draw_wavefunction draws any size (the number of qubits comes from the state)
+draw_wavefunction2 = draw_wavefunction
+draw_wavefunction4 = draw_wavefunction
+draw_wavefunction8 = draw_wavefunction
+draw_wavefunction16 = draw_wavefunction
 
 
 def state_to_str(state, n_qubits=4, ket=True):
@@ -622,6 +1272,8 @@ def make_random_state(n_qubits=1):
 
 
 def make_bell_circuit(alpha=0, beta=0):
+    import cirq
+
     # bell example
     # started with google's example
     # (named photons, added polarizers)
@@ -641,7 +1293,10 @@ def make_bell_circuit(alpha=0, beta=0):
     # theta = 1*np.pi
     # rz only changes the phase
     # ry does nothing?
-    #bell_circuit.append([cirq.rx(alpha).on(q0), cirq.rx(beta).on(q1)])
+    # (only added if an angle is given, the angles can also be symbols, for sweeps,
+    #  such as sympy.Symbol('alpha'), see illustrate_sweep)
+    if alpha != 0 or beta != 0:
+        bell_circuit.append([cirq.rx(alpha).on(q0), cirq.rx(beta).on(q1)])
 
     # append the measurement
     bell_circuit.append(cirq.measure(q0, q1))
@@ -656,6 +1311,8 @@ def pprint_circuit(circuit, text="", indent=4):
     """ displays circuits from google Cirq, by wrapping the text version of the circuit
         in syntax highlighting, which makes it print nicely in color
     """
+    from IPython.display import display, Markdown
+
     # create initial text, by wrapping in quotes (for syntax highlighting)
     if text is None:
         text = ""
@@ -683,28 +1340,616 @@ def indent_text(text, spaces=4):
     return text
 
 
-def make_wavefunction_list(circuit, include_initial_wavefunction=True):
-    """ simulate the circuit, keeping track of the state vectors at ench step"""
-    wavefunctions = []
-    simulator = cirq.Simulator()
+def make_wavefunction_list(circuit, include_initial_wavefunction=True, as_array=False,
+                           state_cache=None, sparse=False, threshold=1e-6, top_k=None):
+    """ simulate the circuit, keeping track of the state vectors at ench step
+
+        by default, returns a list with one (unscrambled) state vector per moment
+        with as_array=True, the states are written straight into a preallocated
+        complex array, shape (n_moments + 1, 2**n) (or (n_moments, 2**n),
+        without the initial wavefunction)
 
-    for i, step in enumerate(simulator.simulate_moment_steps(circuit)):
-        wavefunction_scrambled = step.state_vector()
-        wavefunction = unscramble_wavefunction(wavefunction_scrambled)
-        wavefunctions.append(wavefunction)
+        with a state_cache (a StateCache), the state after every moment is cached,
+        keyed by a fingerprint of the circuit up to that moment, and the simulation
+        resumes from the longest prefix of the circuit already in the cache
+        (so, when a circuit grows moment by moment, only the new moments are simulated)
+
+        with sparse=True, returns a list of SparseWavefunctions instead, keeping only the
+        amplitudes above threshold (and at most top_k per moment, if given), each one records
+        the probability it discarded (for wide circuits, where most amplitudes are zero)
+    """
+    import cirq
+
+    if sparse:
+        if as_array:
+            raise ValueError('sparse wavefunctions can not be returned as an array')
+        return [sparsify_wavefunction(wavefunction, threshold, top_k)
+                for wavefunction in generate_wavefunctions(circuit, include_initial_wavefunction,
+                                                           state_cache)]
+
+    if not as_array:
+        return list(generate_wavefunctions(circuit, include_initial_wavefunction, state_cache))
+
+    # one row per moment, plus (optionally) the initial state
+    first_row = 1 if include_initial_wavefunction else 0
+    n_states = 2**len(circuit.all_qubits())
+    wavefunctions = np.zeros((first_row + len(circuit), n_states), dtype=np.complex64)
 
     if include_initial_wavefunction:
-        initial_wavefunction = wavefunctions[0]*0  # create a blank vector
-        initial_wavefunction[0] = 1
-        wavefunctions = [initial_wavefunction]+wavefunctions
+        wavefunctions[0, 0] = 1
+
+    simulator = cirq.Simulator(dtype=wavefunctions.dtype)
+
+    for i, state in enumerate(_moment_states(circuit, simulator, state_cache)):
+        with _stage('unscramble'):
+            unscramble_wavefunction(state, out=wavefunctions[first_row + i])
 
     return wavefunctions
 
 
+def generate_wavefunctions(circuit, include_initial_wavefunction=True, state_cache=None):
+    """ simulate the circuit, yielding the (unscrambled) state vector at each step,
+        one moment at a time, so the states never have to be held all at once
+        (state_cache: see make_wavefunction_list)
+    """
+    import cirq
+
+    simulator = cirq.Simulator()
+
+    for i, state in enumerate(_moment_states(circuit, simulator, state_cache)):
+        # unscrambling makes a copy, so the simulator's buffer is never handed out
+        with _stage('unscramble'):
+            wavefunction = unscramble_wavefunction(state)
+
+        if i == 0 and include_initial_wavefunction:
+            initial_wavefunction = np.zeros_like(wavefunction)  # create a blank vector
+            initial_wavefunction[0] = 1
+            yield initial_wavefunction
+
+        yield wavefunction
+
+
+def make_sweep_wavefunctions(circuit, sweep, include_initial_wavefunction=True):
+    """ simulate the circuit for every value of a parameter sweep (a cirq.Sweep,
+        or a list of resolvers), returning the (unscrambled) state vectors of all of them,
+        as an array of shape (n_values, n_moments + 1, 2**n) (n_moments, without the
+        initial wavefunction)
+
+        all the values are simulated together, as one stack of states, moment by moment:
+        each gate's (small) unitary is applied to its qubits' axes of the whole stack at once
+        (the same matrix for every value, or one per value, if the gate has parameters),
+        moments with non unitary operations (measurements) are simulated for each value
+        (a circuit with classically controlled operations is simulated for each value,
+        as a whole, since the measurement results are needed later)
+    """
+    import cirq
+
+    resolvers = list(cirq.to_resolvers(sweep))
+
+    if any(cirq.control_keys(op) for op in circuit.all_operations()):
+        return np.stack([make_wavefunction_list(cirq.resolve_parameters(circuit, r),
+                                                include_initial_wavefunction, as_array=True)
+                         for r in resolvers])
+    qubits = sorted(circuit.all_qubits())
+    axis = {q: 1 + i for i, q in enumerate(qubits)}
+
+    # the stack of states, as a tensor, one axis for the values, then one per qubit
+    states = np.zeros((len(resolvers),) + (2,)*len(qubits), dtype=np.complex64)
+    states.reshape(len(resolvers), -1)[:, 0] = 1
+    trajectory = [states] if include_initial_wavefunction else []
+
+    simulator = cirq.Simulator(dtype=np.complex64)
+
+    for moment in _profile_steps('simulate', circuit):
+        if all(cirq.has_unitary(cirq.resolve_parameters(moment, r))
+               for r in (resolvers if cirq.is_parameterized(moment) else resolvers[:1])):
+            for op in moment.operations:
+                if cirq.is_parameterized(op):
+                    unitary = np.stack([cirq.unitary(cirq.resolve_parameters(op, r)) for r in resolvers])
+                else:
+                    unitary = cirq.unitary(op)
+                states = _apply_to_stack(states, unitary.astype(np.complex64),
+                                         [axis[q] for q in op.qubits])
+
+        else:
+            moment_circuit = cirq.Circuit(moment)
+            states = np.stack([simulator.simulate(cirq.resolve_parameters(moment_circuit, r),
+                                                  qubit_order=qubits,
+                                                  initial_state=state.reshape(-1)).final_state_vector
+                               for r, state in zip(resolvers, states)]).reshape(states.shape)
+
+        trajectory.append(states)
+
+    with _stage('unscramble'):
+        return unscramble_wavefunction(np.stack(trajectory, axis=1).reshape(
+            len(resolvers), len(trajectory), 2**len(qubits)))
+
+
+def _apply_to_stack(states, unitary, axes):
+    """ applies a gate's unitary to the qubit axes of a stack of states, shape (P, 2, ..., 2),
+        unitary is a (2**k, 2**k) matrix, for every state, or (P, 2**k, 2**k), one per state
+        (like cirq.apply_unitary, for a whole stack at once) """
+    n_axes = states.ndim
+    new_axes = list(range(n_axes, n_axes + len(axes)))
+
+    unitary = unitary.reshape(unitary.shape[:-2] + (2,)*(2*len(axes)))
+    unitary_axes = ([0] if unitary.ndim > 2*len(axes) else []) + new_axes + list(axes)
+
+    result_axes = list(range(n_axes))
+    for old, new in zip(axes, new_axes):
+        result_axes[old] = new
+
+    return np.einsum(unitary, unitary_axes, states, list(range(n_axes)), result_axes)
+
+
+def _moment_states(circuit, simulator, state_cache=None):
+    """ yields the simulator's state vector (in cirq's order) after each moment
+
+        with a state_cache, the states of the longest cached prefix of the circuit
+        are yielded first, then the simulation resumes from the last one, and the
+        new states are added to the cache (once they have all been simulated)
+    """
+    if state_cache is None:
+        steps = simulator.simulate_moment_steps(circuit)
+        yield from _profile_steps('simulate', (step.state_vector() for step in steps))
+        return
+
+    # the qubits are fixed for the whole circuit (even if a prefix does not use them all)
+    with _stage('state_cache'):
+        qubits = sorted(circuit.all_qubits())
+        keys = prefix_fingerprints(circuit, qubits)
+        states = state_cache.get_prefix(keys)
+    yield from states
+
+    if len(states) < len(keys):
+        steps = simulator.simulate_moment_steps(circuit[len(states):],
+                                                qubit_order=qubits,
+                                                initial_state=states[-1] if states else 0)
+        # cached states are copies, and read only, since they are shared
+        for state in _profile_steps('simulate', (step.state_vector().copy() for step in steps)):
+            state.setflags(write=False)
+            states.append(state)
+            yield state
+
+    state_cache.put_prefix(keys, states)
+
+
+#
+# RENDER CACHE
+#
+
+def circuit_fingerprint(circuit, kind='', **render_args):
+    """ returns a stable fingerprint (hex string) of the circuit,
+        plus the kind of rendering and its arguments (title, indent, labels, ...)
+
+        the circuit is identified by its repr, which lists every moment and operation,
+        including the qubits, so equal circuits always have the same fingerprint
+    """
+    fingerprint = hashlib.sha256()
+    fingerprint.update(repr(circuit).encode())
+    fingerprint.update(kind.encode())
+    fingerprint.update(repr(sorted(render_args.items())).encode())
+    return fingerprint.hexdigest()
+
+
+def prefix_fingerprints(circuit, qubits=None):
+    """ returns a fingerprint (hex string) of every prefix of the circuit
+        (the first moment, the first two moments, ... the whole circuit)
+
+        the qubits (by default, all the qubits of the circuit) are part of every fingerprint,
+        since they fix the size and the order of the simulated states
+    """
+    if qubits is None:
+        qubits = sorted(circuit.all_qubits())
+
+    fingerprint = hashlib.sha256(repr(list(qubits)).encode())
+    fingerprints = []
+    for moment in circuit:
+        fingerprint.update(b'\n' + repr(moment).encode())
+        fingerprints.append(fingerprint.hexdigest())
+    return fingerprints
+
+
+class RenderCache:
+    """ cache of rendered artifacts (html and svg strings), keyed by circuit_fingerprint
+
+        keeps the most recently used artifacts in memory, up to max_bytes (measured as
+        string length, least recently used are evicted first), and, if directory is given,
+        also writes every artifact to that directory (as <key>, for example <fingerprint>.svg),
+        so they survive restarts
+        hit and miss statistics are available from stats()
+        safe to share between threads
+    """
+
+    def __init__(self, max_bytes=64*2**20, directory=None):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+        self._entries = collections.OrderedDict()
+        self._size_bytes = 0
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        """ returns the cached artifact, or None, if it is not in the cache """
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return self._entries[key]
+
+        value = self._read(key)
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            self._store(key, value)
+        return value
+
+    def put(self, key, value):
+        """ adds an artifact (string) to the cache """
+        with self._lock:
+            self._store(key, value)
+        self._write(key, value)
+
+    def get_or_render(self, key, render):
+        """ returns the cached artifact, or calls render() to make it (and caches it) """
+        value = self.get(key)
+        if value is None:
+            value = render()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        """ empties the in-memory cache (files on disk are kept) """
+        with self._lock:
+            self._entries.clear()
+            self._size_bytes = 0
+
+    def stats(self):
+        """ returns the cache statistics, as a dict """
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {'hits': self.hits,
+                    'disk_hits': self.disk_hits,
+                    'misses': self.misses,
+                    'hit_rate': (self.hits + self.disk_hits)/lookups if lookups else 0.0,
+                    'evictions': self.evictions,
+                    'entries': len(self._entries),
+                    'size_bytes': self._size_bytes,
+                    'max_bytes': self.max_bytes}
+
+    def _store(self, key, value):
+        """ adds to the in-memory LRU, evicting old entries (must hold the lock) """
+        if key in self._entries:
+            self._size_bytes -= self._size(self._entries.pop(key))
+        self._entries[key] = value
+        self._size_bytes += self._size(value)
+
+        while self._size_bytes > self.max_bytes and len(self._entries) > 1:
+            _, evicted = self._entries.popitem(last=False)
+            self._size_bytes -= self._size(evicted)
+            self.evictions += 1
+
+    @staticmethod
+    def _size(value):
+        """ size of an artifact, counted towards max_bytes """
+        return len(value)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key)
+
+    def _read(self, key):
+        if self.directory is None or not os.path.exists(self._path(key)):
+            return None
+        with open(self._path(key), 'r', encoding='utf-8') as f:
+            return f.read()
+
+    def _write(self, key, value):
+        if self.directory is None:
+            return
+        # write to a temporary file first, so readers never see half an artifact
+        temporary_path = self._path(key) + '.' + str(os.getpid()) + '.' + str(threading.get_ident())
+        with open(temporary_path, 'w', encoding='utf-8') as f:
+            f.write(value)
+        os.replace(temporary_path, self._path(key))
+
+
+class StateCache(RenderCache):
+    """ cache of simulated states, the state vector after every moment of a circuit,
+        keyed by prefix_fingerprints (see make_wavefunction_list)
+
+        in memory only, up to max_bytes (measured in array bytes), the least recently
+        used states are evicted first, but the states of the first moments are always
+        used more recently than the later ones, so a shared start of many circuits stays
+        hits count the cached moments that were reused, misses the moments that were simulated
+        (note a measured circuit keeps the measurement outcomes of its first simulation)
+    """
+
+    def __init__(self, max_bytes=256*2**20):
+        super().__init__(max_bytes)
+
+    def get_prefix(self, keys):
+        """ returns the cached states for the longest run of keys (from the first one)
+            that are all in the cache """
+        with self._lock:
+            states = []
+            for key in keys:
+                if key not in self._entries:
+                    break
+                states.append(self._entries[key])
+
+            for key in reversed(keys[:len(states)]):
+                self._entries.move_to_end(key)
+
+            self.hits += len(states)
+            self.misses += len(keys) - len(states)
+        return states
+
+    def put_prefix(self, keys, states):
+        """ adds the states of a circuit (one per prefix key) to the cache """
+        with self._lock:
+            for key, state in reversed(list(zip(keys, states))):
+                self._store(key, state)
+
+    @staticmethod
+    def _size(value):
+        return value.nbytes
+
+
+#
+# PROFILING
+#
+
+# one call of a profiled stage (see Profiler), times in seconds, memory in bytes
+#   start is when it started (since the profiler was made), wall_time includes the
+#   stages nested inside it (the simulation inside 'draw', say), self_time does not,
+#   artists is the number of matplotlib artists the stage added (None if it draws nothing),
+#   and peak_memory is the most (traced) memory it allocated (None, unless memory=True)
+ProfileEvent = collections.namedtuple(
+    'ProfileEvent', ['stage', 'start', 'wall_time', 'self_time', 'artists', 'peak_memory'])
+
+# all the calls of a stage, summed up (peak_memory is the largest of any call)
+StageProfile = collections.namedtuple(
+    'StageProfile', ['stage', 'calls', 'wall_time', 'self_time', 'artists', 'peak_memory'])
+
+# the profiler that is on, per thread (stages in other threads are not recorded)
+_profiling = threading.local()
+
+_no_stage = contextlib.nullcontext()
+
+
+class Profiler:
+    """ records the time spent in each stage of illustrating (and simulating) a circuit,
+        while it is on (in a with block, in the thread that entered it)
+
+            with stacasso.Profiler(memory=True) as profiler:
+                fig = stacasso.illustrate_figure(circuit)
+                with profiler.stage('savefig'):
+                    fig.savefig('circuit.png')
+            print(profiler.summary())
+
+        the stages are 'illustrate' (all of it), 'layout' (the circuit diagram),
+        'simulate' (one call per moment), 'state_cache', 'unscramble', 'draw' (the boards
+        and amplitudes), 'tight_layout', 'write_svg' and 'savefig' (where stacasso saves)
+        any other code can be timed as a stage with profiler.stage(name)
+
+        with memory=True, the peak memory of each stage is traced (with tracemalloc,
+        which slows everything down), callback is called with every ProfileEvent,
+        as it ends; report() sums up the events, and chrome_trace() exports them
+    """
+
+    def __init__(self, memory=False, callback=None):
+        self.memory = memory
+        self.callback = callback
+        self.events = []  # ProfileEvents, in the order they ended
+
+        self._origin = time.perf_counter()
+        self._frames = []  # [time in nested stages, peak memory] of each stage that is running
+        self._previous = None
+        self._traced = False
+        self._thread = threading.get_ident()
+
+    def __enter__(self):
+        self._previous = getattr(_profiling, 'profiler', None)
+        _profiling.profiler = self
+        self._thread = threading.get_ident()
+        if self.memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._traced = True
+        return self
+
+    def __exit__(self, *exc_info):
+        _profiling.profiler = self._previous
+        if self._traced:
+            tracemalloc.stop()
+            self._traced = False
+        return False
+
+    @contextlib.contextmanager
+    def stage(self, name, ax=None):
+        """ records the with block as one call of the stage name
+            (ax, the matplotlib Axes the stage draws on, to count the artists it adds) """
+        call = self._begin(ax)
+        try:
+            yield
+        finally:
+            self._end(name, call)
+
+    def _begin(self, ax=None):
+        """ starts a call of a stage, returns what _end needs to record it """
+        artists = len(ax.get_children()) if ax is not None else None
+
+        memory = None
+        if self.memory:
+            # the peak so far belongs to the stage around this one, then starts over
+            memory, peak = tracemalloc.get_traced_memory()
+            if self._frames:
+                self._frames[-1][1] = max(self._frames[-1][1], peak)
+            tracemalloc.reset_peak()
+
+        frame = [0.0, 0]
+        self._frames.append(frame)
+        return frame, ax, artists, memory, time.perf_counter()
+
+    def _end(self, name, call, record=True):
+        """ ends a call of a stage (from _begin), and records it, unless record is False
+            (then its time is left to the stage around it) """
+        frame, ax, artists, memory, start = call
+        wall_time = time.perf_counter() - start
+        self._frames.pop()
+        if not record:
+            return
+        if self._frames:
+            self._frames[-1][0] += wall_time
+
+        if ax is not None:
+            artists = len(ax.get_children()) - artists
+        if self.memory:
+            memory = max(frame[1], tracemalloc.get_traced_memory()[1]) - memory
+
+        event = ProfileEvent(name, start - self._origin, wall_time, wall_time - frame[0],
+                             artists, memory)
+        self.events.append(event)
+        if self.callback is not None:
+            self.callback(event)
+
+    def report(self):
+        """ returns a StageProfile per stage (in the order the stages first started) """
+        stages = {}
+        for event in sorted(self.events, key=lambda event: event.start):
+            calls, wall_time, self_time, artists, peak_memory = stages.get(
+                event.stage, (0, 0.0, 0.0, None, None))
+            if event.artists is not None:
+                artists = (artists or 0) + event.artists
+            if event.peak_memory is not None:
+                peak_memory = max(peak_memory or 0, event.peak_memory)
+            stages[event.stage] = (calls + 1, wall_time + event.wall_time,
+                                   self_time + event.self_time, artists, peak_memory)
+
+        return [StageProfile(stage, *totals) for stage, totals in stages.items()]
+
+    def summary(self):
+        """ the report, as a text table """
+        lines = ['%-14s %6s %10s %10s %8s %12s' % ('stage', 'calls', 'wall (s)', 'self (s)',
+                                                  'artists', 'peak (MB)')]
+        for stage in self.report():
+            lines.append('%-14s %6d %10.4f %10.4f %8s %12s' % (
+                stage.stage, stage.calls, stage.wall_time, stage.self_time,
+                '' if stage.artists is None else stage.artists,
+                '' if stage.peak_memory is None else '%.3f' % (stage.peak_memory/2**20)))
+        return '\n'.join(lines)
+
+    def chrome_trace(self, path=None):
+        """ returns the events in Chrome's trace event format (a dict, for json),
+            to open in chrome://tracing or Perfetto, and writes it to path, if given """
+        pid = os.getpid()
+        trace = {'displayTimeUnit': 'ms', 'traceEvents': []}
+        for event in self.events:
+            args = {'self_time': event.self_time}
+            if event.artists is not None:
+                args['artists'] = event.artists
+            if event.peak_memory is not None:
+                args['peak_memory'] = event.peak_memory
+            trace['traceEvents'].append({'name': event.stage, 'cat': 'stacasso', 'ph': 'X',
+                                         'ts': 1e6*event.start, 'dur': 1e6*event.wall_time,
+                                         'pid': pid, 'tid': self._thread, 'args': args})
+
+        if path is not None:
+            with open(path, 'w', encoding='utf-8') as f:
+                json.dump(trace, f)
+        return trace
+
+
+def _stage(name, ax=None):
+    """ context manager, profiles its block as the stage name, if a Profiler is on
+        (in this thread), otherwise does nothing """
+    profiler = getattr(_profiling, 'profiler', None)
+    if profiler is None:
+        return _no_stage
+    return profiler.stage(name, ax)
+
+
+def _profile_steps(name, steps):
+    """ yields the items of steps (an iterable), profiling each step as a call of the stage name
+        (for generators, where the work happens as each item is taken),
+        the last step, which only finds there are no more items, is not counted """
+    if getattr(_profiling, 'profiler', None) is None:
+        yield from steps
+        return
+
+    steps = iter(steps)
+    end = object()
+    while True:
+        profiler = getattr(_profiling, 'profiler', None)
+        if profiler is None:
+            item = next(steps, end)
+        else:
+            call = profiler._begin()
+            item = end
+            try:
+                item = next(steps, end)
+            finally:
+                profiler._end(name, call, record=item is not end)
+        if item is end:
+            return
+        yield item
+
+
 #
 # UTILITY FUNCTIONS
 #
 
+def test_circuit_diagram():
+    """ checks to_circuit_diagram against the text cirq renders (it copies cirq's sizing rules),
+        for the cases that have broken it: no qubits, no horizontal spacing,
+        and rows made taller by a multi-line entry """
+    import cirq
+
+    q = cirq.LineQubit.range(3)
+    circuits = [
+        cirq.Circuit([cirq.H(q[0]), cirq.CNOT(q[0], q[1]), cirq.CCX(*q), cirq.measure(*q)]),
+        cirq.Circuit([cirq.CircuitOperation(cirq.FrozenCircuit(cirq.H(q[0]), cirq.CNOT(q[0], q[1]))),
+                      cirq.X(q[1])]),
+        cirq.testing.random_circuit(q, 10, .8, random_state=0),
+    ]
+
+    for circuit in circuits:
+        for horizontal_spacing in [0, 1, 3, 6]:
+            diagram = to_circuit_diagram(circuit, horizontal_spacing=horizontal_spacing)
+            assert '\n'.join(diagram.lines) == to_text_diagram(
+                circuit, horizontal_spacing=horizontal_spacing)
+
+            # every wire starts with its name, on the line recorded for it
+            for name, line in zip(diagram.qubit_names, diagram.qubit_lines):
+                assert diagram.lines[line].startswith(name + ':'), (name, diagram.lines[line])
+
+            # one span per moment, in order, inside the diagram
+            assert len(diagram.moment_spans) == len(circuit)
+            ends = [diagram.circuit_start] + [end for start, end in diagram.moment_spans]
+            assert ends == sorted(ends)
+            assert ends[-1] <= max(len(line) for line in diagram.lines)
+
+            # highlighting leaves the text as it is
+            assert html_to_text(highlight(circuit, horizontal_spacing=horizontal_spacing,
+                                          indent=0)).replace('\n', '') == ''.join(diagram.lines)
+
+    # circuits without qubits draw nothing (and highlight to an empty <pre>)
+    for circuit in [cirq.Circuit(), cirq.Circuit([cirq.Moment(), cirq.Moment()])]:
+        assert to_circuit_diagram(circuit).lines == []
+        assert html_to_text(highlight(circuit)).strip() == ''
+
+    print('circuit diagrams ok')
+
+
 def test_regex():
     """ useful to extact a number in a string """
 
@@ -728,9 +1973,12 @@ class HTMLFilter(HTMLParser):
     """ class to strip html to regular text, from
         https://stackoverflow.com/questions/14694482/converting-html-to-text-with-python
 
+        each filter collects its own text (so filters are never shared, between threads or requests)
     """
 
-    text = ""
+    def __init__(self):
+        super().__init__()
+        self.text = ""
 
     def handle_data(self, data):
         self.text += data
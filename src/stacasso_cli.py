@@ -0,0 +1,131 @@
+# command line interface, renders a directory of circuits with Stacasso
+#
+#   stacasso circuits/ -o outputs/ --workers 8
+#
+# every circuit is a cirq JSON file (written with cirq.to_json),
+# and is rendered to <name>.html (highlighted circuit) and <name>.svg (illustration),
+# the formats can be changed with --formats (html, svg, png)
+
+import argparse
+import concurrent.futures
+import io
+import os
+import sys
+import time
+
+
+FORMATS = ['html', 'svg', 'png']
+
+
+def output_paths(circuit_path, output_dir, formats):
+    """ returns the output file for each format, named after the circuit file """
+    name = os.path.splitext(os.path.basename(circuit_path))[0]
+    return {f: os.path.join(output_dir, name + '.' + f) for f in formats}
+
+
+def is_up_to_date(circuit_path, paths):
+    """ true if every output exists, and is newer than the circuit file """
+    circuit_time = os.path.getmtime(circuit_path)
+    return all(os.path.exists(path) and os.path.getmtime(path) >= circuit_time
+               for path in paths.values())
+
+
+def render_file(circuit_path, output_dir, formats=('html', 'svg'), force=False):
+    """ renders one circuit file, returns 'rendered' or 'skipped'
+        (runs inside the worker processes) """
+
+    paths = output_paths(circuit_path, output_dir, formats)
+    if not force and is_up_to_date(circuit_path, paths):
+        return 'skipped'
+
+    # imported here, so the (slow) imports happen once per worker process
+    import cirq
+    import stacasso
+
+    circuit = cirq.read_json(circuit_path)
+
+    # render everything first, so a failed render writes nothing
+    # (a partial output would be newer than the circuit, and look up to date)
+    outputs = {}
+    if 'html' in paths:
+        outputs['html'] = stacasso.highlight(circuit).encode('utf-8')
+
+    if 'svg' in paths:
+        outputs['svg'] = stacasso.illustrate_svg(circuit).encode('utf-8')
+
+    if 'png' in paths:
+        png = io.BytesIO()
+        stacasso.illustrate_figure(circuit).savefig(png, format='png')
+        outputs['png'] = png.getvalue()
+
+    for f, data in outputs.items():
+        write_file(paths[f], data)
+
+    return 'rendered'
+
+
+def write_file(path, data):
+    """ writes data (bytes) to path, through a temporary file, so the file
+        is either complete or not there at all """
+    temporary_path = path + '.' + str(os.getpid()) + '.tmp'
+    try:
+        with open(temporary_path, 'wb') as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+
+
+def find_circuits(input_dir):
+    """ returns the paths of all the circuit (.json) files in input_dir, sorted by name """
+    return sorted(os.path.join(input_dir, name)
+                  for name in os.listdir(input_dir) if name.endswith('.json'))
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog='stacasso',
+        description='Render highlighted html and illustrations for a directory of '
+                    'cirq circuits (saved as JSON, with cirq.to_json).')
+    parser.add_argument('input_dir', help='directory of circuit .json files')
+    parser.add_argument('-o', '--output-dir', default=None,
+                        help='where to write the outputs (default: the input directory)')
+    parser.add_argument('-f', '--formats', nargs='+', choices=FORMATS, default=['html', 'svg'],
+                        help='which outputs to render (default: html svg)')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default: one per cpu)')
+    parser.add_argument('--force', action='store_true',
+                        help='render every circuit, even if its outputs are up to date')
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+
+    output_dir = args.output_dir or args.input_dir
+    os.makedirs(output_dir, exist_ok=True)
+
+    circuit_paths = find_circuits(args.input_dir)
+    counts = {'rendered': 0, 'skipped': 0, 'failed': 0}
+    start = time.time()
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(render_file, path, output_dir, args.formats, args.force): path
+                   for path in circuit_paths}
+
+        for future in concurrent.futures.as_completed(futures):
+            try:
+                counts[future.result()] += 1
+            except Exception as error:
+                counts['failed'] += 1
+                print('failed:', futures[future], '(' + repr(error) + ')', file=sys.stderr)
+
+    print('{rendered} rendered, {skipped} up to date, {failed} failed'.format(**counts),
+          'in {:.1f}s'.format(time.time() - start))
+
+    return 1 if counts['failed'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
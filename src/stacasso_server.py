@@ -0,0 +1,269 @@
+# local rendering service, serves Stacasso renderings over http (asyncio, standard library only)
+#
+#   stacasso-server --port 8765 --workers 4
+#
+# every request posts a circuit, as cirq JSON (written with cirq.to_json), and gets back
+#
+#   POST /highlight?title=...           highlighted circuit (text/html)
+#   POST /illustrate?format=svg         illustration (image/svg+xml, or format=png, image/png)
+#   GET  /metrics                       queue depth, latency and cache statistics (json)
+#
+# rendering runs in a bounded process pool, identical requests which are in flight at
+# the same time are rendered once, and results are cached (by a hash of the request),
+# circuits are only parsed in the workers, so the event loop is never blocked by them
+
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import sys
+import time
+import urllib.parse
+
+
+PATHS = ['/highlight', '/illustrate', '/metrics']
+
+FORMATS = {'html': 'text/html; charset=utf-8',
+           'svg': 'image/svg+xml',
+           'png': 'image/png'}
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error', 503: 'Service Unavailable'}
+
+
+def render(kind, body, options):
+    """ renders a circuit (the request body, cirq JSON), returns str (html, svg) or bytes (png)
+        (runs inside the worker processes, so the event loop never parses circuits) """
+
+    # imported here, so the (slow) imports happen once per worker process
+    import io
+    import cirq
+    import stacasso
+
+    try:
+        circuit = cirq.read_json(json_text=body.decode('utf-8'))
+    except Exception as error:
+        raise HTTPError(400, 'could not read the circuit (' + repr(error) + ')')
+
+    if kind == 'highlight':
+        return stacasso.highlight(circuit, title=options.get('title'))
+
+    if options['format'] == 'svg':
+        return stacasso.illustrate_svg(circuit)
+
+    png = io.BytesIO()
+    stacasso.illustrate_figure(circuit).savefig(png, format='png')
+    return png.getvalue()
+
+
+class HTTPError(Exception):
+    """ an error, sent back to the client with its status code """
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+    def __reduce__(self):
+        # so the error can be raised in a worker process, and sent back
+        return HTTPError, (self.status, str(self))
+
+
+class RenderService:
+    """ renders circuits in a process pool (at most workers at a time, and at most
+        max_pending renders waiting), deduplicating identical in-flight requests,
+        with a RenderCache of the results (keyed by a hash of the request body and options,
+        the circuit itself is only parsed in the worker) """
+
+    def __init__(self, workers=None, max_pending=64, cache_bytes=64*2**20, max_body_bytes=16*2**20):
+        import stacasso
+
+        self.pool = concurrent.futures.ProcessPoolExecutor(max_workers=workers)
+        self.max_pending = max_pending
+        self.max_body_bytes = max_body_bytes
+        self.cache = stacasso.RenderCache(max_bytes=cache_bytes)
+
+        self.in_flight = {}  # fingerprint key -> asyncio.Future of the rendering
+        self.counts = collections.Counter()
+        self.latencies = collections.defaultdict(lambda: collections.deque(maxlen=1000))
+        self.started = time.time()
+
+    async def handle(self, method, path, query, body):
+        """ answers one request, returns (status, content type, body bytes) """
+        if path == '/metrics':
+            if method != 'GET':
+                raise HTTPError(405, 'use GET for ' + path)
+            return 200, 'application/json', json.dumps(self.metrics(), indent=1).encode()
+
+        if path not in PATHS:
+            raise HTTPError(404, 'unknown path ' + path)
+        if method != 'POST':
+            raise HTTPError(405, 'use POST (with a cirq JSON circuit) for ' + path)
+
+        kind = path[1:]
+        if kind == 'highlight':
+            options = {'format': 'html', 'title': query.get('title')}
+        else:
+            options = {'format': query.get('format', 'svg')}
+            if options['format'] not in ('svg', 'png'):
+                raise HTTPError(400, 'format must be svg or png')
+
+        result = await self.render(kind, body, options)
+        if isinstance(result, str):
+            result = result.encode('utf-8')
+        return 200, FORMATS[options['format']], result
+
+    async def render(self, kind, body, options):
+        """ returns the rendering, from the cache, from an identical request in flight,
+            or rendered in the pool """
+        key = hashlib.sha256(body)
+        key.update(repr((kind, sorted(options.items()))).encode())
+        key = key.hexdigest() + '.' + options['format']
+
+        cached = self.cache.get(key)
+        if cached is not None:
+            self.counts['cache_hits'] += 1
+            return cached
+
+        if key in self.in_flight:
+            self.counts['deduplicated'] += 1
+            return await asyncio.shield(self.in_flight[key])
+
+        if len(self.in_flight) >= self.max_pending:
+            self.counts['rejected'] += 1
+            raise HTTPError(503, 'too many renders pending, try again later')
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self.pool, render, kind, body, options)
+        self.in_flight[key] = future
+        self.counts['renders'] += 1
+        try:
+            result = await asyncio.shield(future)
+        finally:
+            del self.in_flight[key]
+
+        self.cache.put(key, result)
+        return result
+
+    def metrics(self):
+        """ queue depth, request counts and latencies (per path, in seconds), cache statistics """
+        latencies = {}
+        for path, values in self.latencies.items():
+            values = sorted(values)
+            latencies[path] = {'count': len(values),
+                               'mean': sum(values)/len(values),
+                               'p50': values[len(values)//2],
+                               'p95': values[min(len(values) - 1, int(.95*len(values)))],
+                               'max': values[-1]}
+
+        return {'uptime': time.time() - self.started,
+                'queue_depth': len(self.in_flight),
+                'max_pending': self.max_pending,
+                'counts': dict(self.counts),
+                'latency': latencies,
+                'cache': self.cache.stats()}
+
+    async def serve_connection(self, reader, writer):
+        """ reads one http request from the connection, and writes the response """
+        start = time.perf_counter()
+        path = None
+        try:
+            try:
+                method, path, query, body = await self.read_request(reader)
+                status, content_type, content = await self.handle(method, path, query, body)
+            except HTTPError as error:
+                status, content_type, content = error.status, 'text/plain', str(error).encode()
+            except Exception as error:
+                status, content_type, content = 500, 'text/plain', repr(error).encode()
+
+            self.counts[str(status)] += 1
+            writer.write(('HTTP/1.1 %d %s\r\n' % (status, REASONS.get(status, ''))
+                          + 'Content-Type: %s\r\n' % content_type
+                          + 'Content-Length: %d\r\n' % len(content)
+                          + 'Connection: close\r\n\r\n').encode() + content)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+            if path is not None:
+                self.latencies[path if path in PATHS else 'other'].append(time.perf_counter() - start)
+
+    async def read_request(self, reader):
+        """ returns the method, path, query (dict) and body of a request """
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            method, target = request_line[0], request_line[1]
+        except (IndexError, UnicodeDecodeError):
+            raise HTTPError(400, 'bad request line')
+
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').strip()
+            if not line:
+                break
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+
+        try:
+            length = int(headers.get('content-length', 0))
+        except ValueError:
+            raise HTTPError(400, 'bad Content-Length')
+        if length < 0:
+            raise HTTPError(400, 'bad Content-Length')
+        if length > self.max_body_bytes:
+            raise HTTPError(413, 'circuit too large')
+        body = await reader.readexactly(length) if length else b''
+
+        url = urllib.parse.urlsplit(target)
+        query = {name: values[-1] for name, values in urllib.parse.parse_qs(url.query).items()}
+        return method, url.path, query, body
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+async def serve(host='127.0.0.1', port=8765, **service_args):
+    """ runs the service until cancelled """
+    service = RenderService(**service_args)
+    server = await asyncio.start_server(service.serve_connection, host, port)
+    print('stacasso server on http://%s:%d (POST /highlight, /illustrate, GET /metrics)' % (host, port))
+    try:
+        async with server:
+            await server.serve_forever()
+    finally:
+        service.close()
+
+
+def make_parser():
+    parser = argparse.ArgumentParser(
+        prog='stacasso-server',
+        description='Serve highlighted html and illustrations (svg, png) of cirq circuits '
+                    '(posted as JSON, written with cirq.to_json), on a local http port.')
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen on (default: 127.0.0.1)')
+    parser.add_argument('--port', type=int, default=8765, help='port to listen on (default: 8765)')
+    parser.add_argument('-w', '--workers', type=int, default=os.cpu_count(),
+                        help='number of worker processes (default: one per cpu)')
+    parser.add_argument('--max-pending', type=int, default=64,
+                        help='renders in flight, before new ones are refused with 503 (default: 64)')
+    parser.add_argument('--cache-mb', type=float, default=64,
+                        help='size of the in-memory render cache, in MB (default: 64)')
+    return parser
+
+
+def main(argv=None):
+    args = make_parser().parse_args(argv)
+    try:
+        asyncio.run(serve(args.host, args.port,
+                          workers=args.workers,
+                          max_pending=args.max_pending,
+                          cache_bytes=int(args.cache_mb*2**20)))
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -3,10 +3,13 @@
 # this document retains the original Apache 2.0 licence
 # https://github.com/quantumlib/Cirq/blob/master/docs/tutorials/educators/textbook_algorithms.ipynb
 
+import collections
+
 import cirq
 import random
 import matplotlib.pyplot as plt
 import numpy as np
+import sympy
 
 def make_quantum_teleportation_circuit(gate):
     """Returns a circuit for quantum teleportation.
@@ -84,4 +87,65 @@ def test():
     print(np.round(bobs_bloch_vector, 3))
 
     # Verify they are the same state!
-    np.testing.assert_allclose(bobs_bloch_vector, message_bloch_vector, atol=1e-7)
\ No newline at end of file
+    np.testing.assert_allclose(bobs_bloch_vector, message_bloch_vector, atol=1e-7)
+
+
+# results of teleportation_sweep, one row per value of the message gate parameter
+TeleportationSweep = collections.namedtuple(
+    'TeleportationSweep', ['values', 'message_bloch_vectors', 'bob_bloch_vectors', 'fidelities'])
+
+
+def bloch_vectors(state_vectors, index=0):
+    """Bloch vectors of one qubit, for a stack of state vectors (one per row).
+
+    Same as cirq.bloch_vector_from_state_vector, for every row at once.
+    Returns an (n_states, 3) array.
+    """
+    state_vectors = np.asarray(state_vectors)
+    n_qubits = int(np.log2(state_vectors.shape[-1]))
+
+    # reduced density matrix of the qubit, from the state as a tensor (qubit axis in the middle)
+    psi = state_vectors.reshape(-1, 2**index, 2, 2**(n_qubits - index - 1))
+    rho = np.einsum('nasb,natb->nst', psi, psi.conj())
+
+    return np.stack([2 * rho[:, 0, 1].real,
+                     2 * rho[:, 1, 0].imag,
+                     (rho[:, 0, 0] - rho[:, 1, 1]).real], axis=-1)
+
+
+def teleportation_sweep(values, gate=cirq.X, symbol='t', seed=None):
+    """Teleports the message prepared by gate ** t, for every t in values.
+
+    The teleportation circuit is built once, with a symbolic message gate,
+    and all the values are simulated in a single simulate_sweep.
+    Returns a TeleportationSweep, with the Bloch vectors of the message and
+    of Bob's qubit, and the fidelity of the teleported state, for each value.
+    """
+    values = np.asarray(values, dtype=float)
+    parameter = sympy.Symbol(symbol)
+    message_gate = gate ** parameter
+    sweep = cirq.Points(symbol, values)
+
+    sim = cirq.Simulator(seed=seed)
+
+    # the teleportation circuit, with Bob's qubit at index 1 (qubits sort by name)
+    circuit = make_quantum_teleportation_circuit(message_gate)
+    results = sim.simulate_sweep(circuit, sweep)
+    bob = bloch_vectors([result.final_state_vector for result in results], index=1)
+
+    # the message itself
+    message_circuit = cirq.Circuit(message_gate.on(cirq.NamedQubit("Message")))
+    results = sim.simulate_sweep(message_circuit, sweep)
+    message = bloch_vectors([result.final_state_vector for result in results], index=0)
+
+    # fidelity of two pure qubit states, from their Bloch vectors
+    fidelities = (1 + np.sum(bob * message, axis=-1)) / 2
+
+    return TeleportationSweep(values, message, bob, fidelities)
+
+
+def test_sweep(n_values=1000):
+    """Teleport many messages, and check they all arrive."""
+    sweep = teleportation_sweep(np.linspace(0, 2, n_values), seed=0)
+    print("Teleported %d messages, lowest fidelity: %.7f" % (n_values, sweep.fidelities.min()))
+    np.testing.assert_allclose(sweep.bob_bloch_vectors, sweep.message_bloch_vectors, atol=1e-6)